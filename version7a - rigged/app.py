@@ -1,30 +1,92 @@
+import argparse
+import contextlib
+import logging
+import os
+import time
+
 import pyglet
 from pyglet.window import key
 
 from menu import Menu
 from game import Game
+from timestep import FixedTimestep
+from governor import Governor, Degradation
+from profiler import profiler, Overlay, watch_simulation
+from hud import HUD
+from inputs import InputPipeline
+from simthread import SimulationThread
+from waves import WAVES
+import net
 import resources
+import layers
+
+
+# a paused match is kept here, so that it can be continued after a restart
+SUSPEND_FILE = 'saves/paused.skyp'
+
+log = logging.getLogger(__name__)
 
 
 class AppWindow(pyglet.window.Window):
-    def __init__(self, *args, **kwargs):
+    def __init__(self, *args, sim_rate = 120, render_rate = 60, net = None, waves = None, threaded = False, **kwargs):
         super().__init__(*args, **kwargs)
 
+        # a NetHost or NetClient for co-op, None plays alone, and the name of a wave script to play
+        self.net = net
+        self.waves = waves
+
+        # threaded runs the game logic on a SimulationThread of its own, the main loop then only draws what it publishes
+        self.threaded = threaded
+        self.simulation = None
+
         self.states = {
             'MAIN_MENU': 0,
             'PLAYING': 1,
             'PAUSED': 2,
             'GAME_OVER': 3,
             'TOP_SCORES': 4,
-            'MORE_MENU': 5
+            'MORE_MENU': 5,
+            'LOADING': 6
         }
 
-        self.state = self.states['MAIN_MENU']
+        self.state = self.states['LOADING']
+        self.batches = []
 
-        # Key handlers saves the state of the keyboard
-        self.key_handler = key.KeyStateHandler()
+        # the keys are stamped as they come and handed to the next tick, so a tap shorter than a tick still gets there
+        self.key_handler = InputPipeline()
         self.push_handlers(self.key_handler)
 
+        # assets load in the background while the loading screen is up
+        self.loading_label = pyglet.text.Label('LOADING', x = self.width//2, y = self.height//2, anchor_x = 'center', anchor_y = 'center')
+        resources.manager.start()
+
+        # the game logic always steps at sim_rate, frames come at render_rate
+        self.timestep = FixedTimestep(sim_rate)
+        pyglet.clock.schedule_interval(self.update, 1.0 / render_rate)
+
+        # F2 hands the ship to the autopilot, F3 shows the profiler, F4 writes its trace, F5 rewinds
+        self.overlay = Overlay(profiler, 10, self.height - 10)
+
+        # gives up detail while a frame takes longer than the render rate allows
+        self.governor = Governor(1.0 / render_rate, self.degradations())
+
+
+    def degradations(self):
+        """ What the governor may give up under load, in order, the least noticeable first
+
+        Only drawing and sound may be given up, anything the simulation does would make the score depend on the machine.
+        """
+        def setting(owner, attribute, degraded, normal):
+            return (lambda: setattr(owner(), attribute, degraded), lambda: setattr(owner(), attribute, normal))
+        return [
+            Degradation('hud every 8th tick', *setting(lambda: self.game, 'hud_interval', 8, 1)),
+            Degradation('2 sound voices', lambda: self.game.audio.set_voices(2), lambda: self.game.audio.set_voices(8)),
+            Degradation('at most 1000 enemy bullets drawn', *setting(lambda: self.game.bullet_renderers[1], 'limit', 1000, None)),
+        ]
+
+
+    def finish_loading(self):
+        """ Builds the screens once every essential asset is in """
         self.menu = Menu(self)
         self.game = Game(self)
 
@@ -34,39 +96,165 @@ class AppWindow(pyglet.window.Window):
         self.menu.menu_buttons[2].func = self.show_more
         self.menu.menu_buttons[3].func = self.do_exit
         self.menu.top_scores_buttons[0].func = self.go_back
+        self.menu.more_menu_buttons[0].func = self.go_back
         self.menu.pause_menu_buttons[0].func = self.continue_game
         self.menu.pause_menu_buttons[1].func = self.quit_game
         self.game.game_hud_buttons[0].func = self.pause_game
         self.game.game_over_buttons[0].func = self.quit_game
 
-        # set up window media player
+        # set up window media player, the music is only loaded once the main menu is up
         self.player = pyglet.media.Player()
         self.player.loop = True
-        self.player.queue(resources.music)
         self.player.volume = 0.25
-        self.player.play()
+        pyglet.clock.schedule_once(self.start_music, 0)
+
+        self.instrument()
+        self.set_state(self.states['MAIN_MENU'])
+
+        # a match left paused last time comes back paused
+        if self.net is None and os.path.exists(SUSPEND_FILE):
+            try:
+                self.game.resume(SUSPEND_FILE)
+                self.set_state(self.states['PAUSED'])
+            except (OSError, ValueError) as error:
+                # a save that cannot be resumed now never will be, so it is not tried again on every start
+                log.warning('could not resume %s: %s', SUSPEND_FILE, error)
+                self.forget_suspended()
 
-        pyglet.clock.schedule_interval(self.update, 1.0 / 120.0)
+        if self.threaded:
+            self.simulation = SimulationThread(self.game, round(1/self.timestep.step))
+            self.simulation.start()
+
+        log.info('Sky Fight loaded in %.2f s', resources.manager.startup_time)
+
+
+    def start_music(self, dt):
+        self.player.queue(resources.music)
+        self.player.play()
 
 
     def update(self, dt):
-        self.menu.update_batch()
-        self.game.update(dt)
+        if self.state == self.states['LOADING']:
+            if resources.manager.poll():
+                self.finish_loading()
+            else:
+                self.loading_label.text = f'LOADING {round(100*resources.manager.progress)}%'
+            return
+
+        start = time.perf_counter()
+        if self.simulation is None:
+            dropped = self.timestep.dropped
+            self.timestep.advance(dt, self.game.update)
+            self.game.sync(self.timestep.alpha)
+            behind = self.timestep.dropped > dropped
+        else:
+            dropped = self.simulation.dropped
+            self.present()
+            behind = self.simulation.dropped > dropped
+        if self.state == self.states['PLAYING']:
+            self.governor.tick(time.perf_counter() - start, behind)
+            self.governor.update(dt)
+
+        if profiler.enabled:
+            bullets = len(self.game.player_bullets) + len(self.game.enemy_bullets)
+            quads = sum(renderer.quads() for renderer in self.game.bullet_renderers)
+            profiler.frame()
+            profiler.counter('bullets', bullets)
+            profiler.counter('bullet quads', quads)
+            latency = self.key_handler.latency
+            self.overlay.update(dt, bullets = bullets, quads = quads, degraded = self.governor.level,
+                                input_p99 = f'{latency.percentile(99):.0f}ms')
+
+
+    def present(self):
+        """ Shows the latest state the simulation thread published, reading it takes no lock """
+        state = self.simulation.front
+        self.game.present(state, self.simulation.alpha(state))
+        if state.over and self.state == self.states['PLAYING']:
+            with self.between_ticks():
+                self.set_state(self.states['GAME_OVER'])
+
+
+    def between_ticks(self):
+        """ Holds the simulation thread, if there is one, while the main thread changes the match """
+        return self.simulation.paused() if self.simulation is not None else contextlib.nullcontext()
+
+
+    def on_close(self):
+        if self.simulation is not None:
+            self.simulation.stop()
+        super().on_close()
 
 
     def on_draw(self):
-        app_window.clear()
-        some_x = -425 if app_window.state in [app_window.states['PLAYING'], app_window.states['GAME_OVER']] else 0
-        resources.background_image.blit(some_x, 0)
-        self.menu.draw()
-        self.game.draw()
+        self.clear()
+        if self.state == self.states['LOADING']:
+            self.loading_label.draw()
+            return
+        start = time.perf_counter()
+        for batch in self.batches:
+            batch.draw()
+        self.overlay.draw()
+        if self.state == self.states['PLAYING']:
+            self.governor.draw(time.perf_counter() - start)
+
+
+    @property
+    def draw_calls(self):
+        """ Draw calls and texture binds of one frame """
+        if self.state == self.states['LOADING']:
+            return (1, 1)
+        counts = [layers.draw_calls(batch) for batch in self.batches]
+        return (sum(calls for calls, textures in counts), sum(textures for calls, textures in counts))
+
+
+    def set_state(self, state):
+        """ Switches to another screen, which only picks the prebuilt batches to draw """
+        self.state = state
+        # the game's batches go first, so a menu over the match is drawn on top of it
+        self.batches = self.game.enter(state) + self.menu.enter(state)
+
+
+    def instrument(self):
+        """ Tells the profiler what to time, the batches are watched again whenever the screens are rebuilt """
+        profiler.forget('app')
+        profiler.forget('screens')
+        watch_simulation(profiler, 'app')
+        profiler.watch(Game, 'update', 'tick', 'app')
+        profiler.watch(Game, 'sync', 'sync', 'app')
+        profiler.watch(Game, 'present', 'present', 'app')
+        profiler.watch(HUD, 'update', 'hud', 'app')
+        profiler.watch(AppWindow, 'on_draw', 'draw', 'app')
+        profiler.watch(AppWindow, 'set_state', 'set state', 'app')
+        for screen in [self.menu, self.game]:
+            for name, value in vars(screen).items():
+                if isinstance(value, pyglet.graphics.Batch):
+                    profiler.watch(value, 'draw', 'draw ' + name, 'screens')
+
+
+    def on_key_press(self, symbol, modifiers):
+        super().on_key_press(symbol, modifiers)
+        if symbol == key.F2 and self.state != self.states['LOADING']:
+            with self.between_ticks():
+                self.game.toggle_autopilot()
+        elif symbol == key.F5 and self.state == self.states['PLAYING']:
+            with self.between_ticks():
+                self.game.rewind()
+        elif symbol == key.F3:
+            self.overlay.visible = profiler.toggle()
+        elif symbol == key.F4:
+            filename = 'traces/' + time.strftime('%Y%m%d-%H%M%S') + '.json'
+            log.info('%d trace events written to %s', profiler.dump(filename), filename)
 
 
     def on_mouse_motion(self, x, y, button, modifiers):
-        self.menu.on_hover(x, y, button, modifiers)
+        if self.state != self.states['LOADING']:
+            self.menu.on_hover(x, y, button, modifiers)
 
 
     def on_mouse_press(self, x, y, button, modifiers):
+        if self.state == self.states['LOADING']:
+            return
         self.menu.on_click(x, y, button, modifiers)
         self.game.on_click(x, y, button, modifiers)
 
@@ -74,15 +262,15 @@ class AppWindow(pyglet.window.Window):
     # only button functions follow
     def start_game(self):
         if self.state == self.states['MAIN_MENU']:
-            self.state = self.states['PLAYING']
+            self.set_state(self.states['PLAYING'])
 
     def show_scores(self):
         if self.state == self.states['MAIN_MENU']:
-            self.state = self.states['TOP_SCORES']
+            self.set_state(self.states['TOP_SCORES'])
 
     def show_more(self):
         if self.state == self.states['MAIN_MENU']:
-            self.state = self.states['MORE_MENU']
+            self.set_state(self.states['MORE_MENU'])
 
     def do_exit(self):
         if self.state == self.states['MAIN_MENU']:
@@ -90,30 +278,65 @@ class AppWindow(pyglet.window.Window):
 
     def go_back(self):
         if self.state in [self.states['TOP_SCORES'], self.states['MORE_MENU']]:
-            self.state = self.states['MAIN_MENU']
+            self.set_state(self.states['MAIN_MENU'])
 
     def pause_game(self):
         if self.state == self.states['PLAYING']:
-            self.state = self.states['PAUSED']
+            with self.between_ticks():
+                self.game.suspend(SUSPEND_FILE)
+                self.set_state(self.states['PAUSED'])
 
     def continue_game(self):
         if self.state == self.states['PAUSED']:
-            self.state = self.states['PLAYING']
+            self.forget_suspended()
+            self.set_state(self.states['PLAYING'])
+
+    def forget_suspended(self):
+        if os.path.exists(SUSPEND_FILE):
+            os.remove(SUSPEND_FILE)
 
     def quit_game(self):
         if self.state in [self.states['PAUSED'], self.states['GAME_OVER']]:
+            self.forget_suspended()
 
             if self.state == self.states['GAME_OVER']:
-                self.menu.update_scores('You', self.game.score)
+                self.menu.update_scores('You', self.game.score, self.game.replay_file)
 
             # reset game
-            self.game = Game(self)
+            with self.between_ticks():
+                self.game = Game(self)
+                if self.simulation is not None:
+                    self.simulation.match = self.game
             self.game.game_hud_buttons[0].func = self.pause_game
             self.game.game_over_buttons[0].func = self.quit_game
+            self.governor.reapply()
+            self.instrument()
 
             # then go back to main menu
-            self.state = self.states['MAIN_MENU']
-
-
-app_window = AppWindow(1024, 768, "Sky Fight")
-pyglet.app.run()
+            self.set_state(self.states['MAIN_MENU'])
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Sky Fight')
+    parser.add_argument('--host', type = int, nargs = '?', const = net.PORT, help = 'host a co-op match on this port')
+    parser.add_argument('--join', help = 'join a co-op match at host[:port]')
+    parser.add_argument('--profile', action = 'store_true', help = 'start with the profiler on, F3 toggles it')
+    parser.add_argument('--waves', choices = list(WAVES), help = 'send in waves of enemies besides the boss')
+    parser.add_argument('--threaded', action = 'store_true', help = 'run the game logic on a thread of its own, apart from drawing')
+    args = parser.parse_args()
+    logging.basicConfig(level = logging.INFO, format = '%(message)s')
+    if args.waves and (args.host or args.join):
+        parser.error('--waves cannot be played in co-op, only the enemies there at the start are sent to the client')
+
+    connection = None
+    if args.host:
+        connection = net.NetHost(args.host)
+    elif args.join:
+        address, _, port = args.join.partition(':')
+        connection = net.NetClient(address, int(port) if port else net.PORT)
+
+    app_window = AppWindow(1024, 768, "Sky Fight", net = connection, waves = args.waves, threaded = args.threaded)
+    if args.profile:
+        profiler.enable()
+        app_window.overlay.visible = True
+    pyglet.app.run()
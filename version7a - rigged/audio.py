@@ -0,0 +1,90 @@
+import time
+
+import pyglet
+
+
+class AudioManager:
+    """ Plays the sound effects of game events through a small, fixed set of voices """
+    def __init__(self, events, sounds, max_voices = 8):
+        # sounds is anything with the static sources of resources.py
+        self.sounds = sounds
+        self.max_voices = max_voices
+        self.voices = []
+        self.started = dict()
+
+        # shortest time between two plays of the same sound, more frequent ones are dropped
+        self.min_interval = {
+            'enemy_attack': 0.1,
+            'damage': 0.05,
+            'death_sound': 0,
+            'defeat_sound': 0,
+        }
+        self.last_played = dict()
+        self.played = 0
+        self.dropped = 0
+
+        events.subscribe('volley_fired', self.on_volley_fired)
+        events.subscribe('enemy_hit', self.on_enemy_hit)
+        events.subscribe('enemy_defeated', self.on_enemy_defeated)
+        events.subscribe('player_hit', self.on_player_hit)
+
+
+    def on_volley_fired(self, bullets):
+        self.play('enemy_attack')
+
+
+    def on_enemy_hit(self, enemy, hits):
+        # the boss only cries out when it is nearly beaten
+        if enemy.health < 250:
+            self.play('damage')
+
+
+    def on_enemy_defeated(self, enemy):
+        self.play('defeat_sound')
+
+
+    def on_player_hit(self, player):
+        self.play('death_sound')
+
+
+    def play(self, name):
+        now = time.perf_counter()
+        if now - self.last_played.get(name, -1e9) < self.min_interval.get(name, 0):
+            self.dropped += 1
+            return
+        voice = self.free_voice()
+        if voice is None:
+            self.dropped += 1
+            return
+
+        self.last_played[name] = now
+        self.started[voice] = now
+        voice.queue(getattr(self.sounds, name))
+        voice.play()
+        self.played += 1
+
+
+    def free_voice(self):
+        """ Returns an idle voice, a new one while under max_voices, or else the one playing the longest """
+        for voice in self.voices:
+            if voice.source is None:
+                return voice
+        if len(self.voices) < self.max_voices:
+            voice = pyglet.media.Player()
+            self.voices.append(voice)
+            return voice
+        if self.max_voices == 0:
+            return None
+
+        oldest = min(self.voices, key = lambda voice: self.started[voice])
+        oldest.next_source()
+        return oldest
+
+
+    def set_voices(self, max_voices):
+        """ Changes how many sounds may play at once, the voices above it are stopped """
+        self.max_voices = max_voices
+        for voice in self.voices[max_voices:]:
+            voice.delete()
+            self.started.pop(voice, None)
+        self.voices = self.voices[:max_voices]
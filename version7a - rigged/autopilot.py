@@ -0,0 +1,98 @@
+import time
+
+import numpy as np
+from pyglet.window import key
+
+
+# every move the player can make, as the keys and the direction they give; WASD keeps the ship on the field
+DIRECTIONS = [
+    ([], 0, 0),
+    ([key.A], -1, 0), ([key.D], 1, 0), ([key.W], 0, 1), ([key.S], 0, -1),
+    ([key.A, key.W], -1, 1), ([key.D, key.W], 1, 1), ([key.A, key.S], -1, -1), ([key.D, key.S], 1, -1),
+]
+
+
+class Autopilot:
+    """ Takes the place of a KeyStateHandler for one player, picks a dodge every tick from where the enemy bullets are headed """
+    def __init__(self, sim, player, horizon = 30, margin = 6, dt = 1/120, limit = 256):
+        self.sim = sim
+        self.player = player
+        self.ticks = horizon
+        self.horizon = horizon*dt           # seconds ahead every move is checked for
+        self.margin = margin
+        self.dt = dt
+        self.limit = limit                  # most bullets judged a decision, the soonest ones, so a dense field costs no more than this
+
+        # every direction at full speed and focused, side by side so all of them are judged in one go
+        self.moves = []
+        velx = []
+        vely = []
+        for keys, dx, dy in DIRECTIONS:
+            for focus in [False, True]:
+                speed = 300 if focus else 600
+                self.moves.append(set(keys + [key.Z] + ([key.LSHIFT] if focus else [])))
+                velx.append(dx*speed)
+                vely.append(dy*speed)
+        self.velx = np.array(velx, dtype=float)[:, None]
+        self.vely = np.array(vely, dtype=float)[:, None]
+        self.travel = np.hypot(self.velx, self.vely).max()*self.horizon
+
+        self.held = self.moves[0]
+        self.decided_on = None
+        self.decisions = 0
+        self.seconds = 0
+        self.slowest = 0
+
+
+    def __getitem__(self, symbol):
+        return symbol in self.held
+
+
+    def advance(self, tick):
+        """ Decides the keys of a tick before it is stepped, so whatever reads them, the recorder too, sees the same ones """
+        if self.decided_on != tick:
+            self.decided_on = tick
+            self.held = self.moves[self.decide()]
+
+
+    def decide(self):
+        """ Returns the index of the safest move """
+        start = time.perf_counter()
+        player = self.player
+        bullets = self.sim.enemy_bullets
+
+        # only bullets that come within reach of wherever the ship can get are judged, the soonest of them first
+        cost = np.zeros(len(self.moves))
+        near, when = bullets.threats(player.x, player.y, player.hitbox_radius + self.margin + self.travel, self.ticks, self.dt)
+        if len(near) > self.limit:
+            near = near[np.argpartition(when, self.limit)[:self.limit]]
+
+        # how close every one of them gets to the ship for every move, and how soon
+        if len(near) > 0:
+            t, distance_squared = bullets.closest_approach(player.x, player.y, self.velx, self.vely, self.horizon, near)
+            reach = player.hitbox_radius + bullets.radius[near] + self.margin
+            closeness = np.clip(reach - np.sqrt(distance_squared), 0, None)/reach
+            soon = 2 - t/self.horizon
+            cost += (closeness*soon).sum(axis = 1)
+
+        # walls are to be kept away from, and the ship would rather sit under the enemy to hit it
+        x = player.x + self.velx[:, 0]*self.horizon
+        y = player.y + self.vely[:, 0]*self.horizon
+        width, height = self.sim.bounds
+        wall = 60
+        cost += 0.2*(np.clip(wall - x, 0, None) + np.clip(x - (width - wall), 0, None) + np.clip(wall - y, 0, None) + np.clip(y - height/2, 0, None))/wall
+        if self.sim.enemies:
+            cost += 0.05*np.abs(x - self.sim.enemies[0].x)/width
+        cost += 0.02*np.abs(y - self.sim.height/6)/height
+
+        choice = int(np.argmin(cost))
+        elapsed = time.perf_counter() - start
+        self.decisions += 1
+        self.seconds += elapsed
+        self.slowest = max(self.slowest, elapsed)
+        return choice
+
+
+    def stats(self):
+        """ Returns the mean and slowest decision, in microseconds """
+        return (1e6*self.seconds/max(self.decisions, 1), 1e6*self.slowest)
@@ -0,0 +1,242 @@
+import argparse
+import gc
+import json
+import statistics
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+from headless import ScriptedInput, create_simulation, strafe_script
+import replay
+import savestate
+from bullets import BulletStore
+from utils import Enemy, Player, NullSprite
+from patterns import BOSSES
+
+
+# boss health that puts the enemy in each firing phase
+PHASES = {'phase1': 900, 'phase2': 500, 'phase3': 300}
+
+# more bullets come from more enemies spread along the top of the field
+DENSITIES = {'1x': 1, '5x': 5, '20x': 20}
+
+DT = 1/120
+
+
+def create_scenario(phase, density):
+    """ A match with density enemies spread along the top, all of them starting in the phase """
+    sim = create_simulation()
+    # the enemies come in at the health of the boss so phases that start with the first hit still fire
+    extra = sim.spawn_enemies(sim.bounds[0]*np.arange(1, density)/density, sim.enemy.y, sim.enemy.boss, sim.enemy.start_health, 50)
+    for enemy in [sim.enemy] + extra:
+        enemy.health = PHASES[phase]
+    return sim
+
+
+def hold_scenario(sim, phase):
+    """ Keeps the match in the same phase for as long as the benchmark runs """
+    for enemy in sim.enemies:
+        enemy.health = PHASES[phase]
+    sim.player.lives = 3
+
+
+def run_ticks(sim, inputs, phase, ticks, measure = None):
+    for _ in range(ticks):
+        inputs.advance(sim.tick_counter + 1)
+        hold_scenario(sim, phase)
+        if measure is None:
+            sim.step(DT, inputs)
+        else:
+            measure(lambda: sim.step(DT, inputs))
+
+
+def bench_simulation(phase, density, ticks, warmup):
+    """ Returns the timing and memory figures of one scenario """
+    inputs = ScriptedInput(strafe_script(2*(ticks + warmup)))
+
+    # timing pass
+    sim = create_scenario(phase, density)
+    run_ticks(sim, inputs, phase, warmup)
+    times = []
+    bullets = []
+    def timed(step):
+        start = time.perf_counter()
+        step()
+        times.append(time.perf_counter() - start)
+        bullets.append(len(sim.enemy_bullets) + len(sim.player_bullets))
+    gc.collect()
+    run_ticks(sim, inputs, phase, ticks, timed)
+
+    # memory pass, tracemalloc slows everything down so it is kept apart from the timings
+    inputs = ScriptedInput(strafe_script(2*(ticks + warmup)))
+    sim = create_scenario(phase, density)
+    run_ticks(sim, inputs, phase, warmup)
+    transient = []
+    blocks = []
+    def traced(step):
+        blocks_before = sys.getallocatedblocks()
+        tracemalloc.reset_peak()
+        before = tracemalloc.get_traced_memory()[0]
+        step()
+        transient.append(tracemalloc.get_traced_memory()[1] - before)
+        blocks.append(sys.getallocatedblocks() - blocks_before)
+    tracemalloc.start()
+    run_ticks(sim, inputs, phase, ticks, traced)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return summarize(times, {
+        'bullets': statistics.mean(bullets),
+        'alloc_kib_per_tick': statistics.mean(transient)/1024,
+        'blocks_per_tick': statistics.mean(blocks),
+        'peak_mib': peak/2**20,
+    })
+
+
+def bench_emitters(repeats):
+    """ Times one volley of every compiled boss pattern into an empty store """
+    enemy = Enemy(384, 672, NullSprite(), 50)
+    player = Player(384, 128, NullSprite(), 5)
+    results = {}
+    tick = 60
+    for name, emitter in BOSSES['sky_fight'].patterns.items():
+        bullets = BulletStore()
+        times = []
+        for _ in range(repeats):
+            bullets.clear()
+            start = time.perf_counter()
+            emitter.fire(enemy, player, tick, bullets)
+            times.append(time.perf_counter() - start)
+        results['emit_' + name] = summarize(times, {'bullets': len(bullets)})
+    return results
+
+
+def bench_savestates(ticks, warmup):
+    """ Times taking and restoring a snapshot of the busiest scenario """
+    inputs = ScriptedInput(strafe_script(2*(ticks + warmup)))
+    sim = create_scenario('phase3', DENSITIES['5x'])
+    run_ticks(sim, inputs, 'phase3', warmup)
+    takes = []
+    restores = []
+    size = 0
+    for _ in range(ticks):
+        run_ticks(sim, inputs, 'phase3', 1)
+        start = time.perf_counter()
+        state = savestate.snapshot(sim)
+        takes.append(time.perf_counter() - start)
+        start = time.perf_counter()
+        savestate.restore(sim, state)
+        restores.append(time.perf_counter() - start)
+        size = max(size, len(state))
+    return {
+        'snapshot_phase3_5x': summarize(takes, {'kib': size/1024}),
+        'restore_phase3_5x': summarize(restores, {}),
+    }
+
+
+def bench_replay(filename):
+    """ Times every tick of a recorded run played back """
+    recorded = replay.load(filename)
+    sim = create_simulation(recorded.width, recorded.height)
+    inputs = replay.ReplayInput(recorded.runs)
+    times = []
+    gc.collect()
+    while not sim.over and sim.tick_counter < recorded.ticks:
+        inputs.advance(sim.tick_counter + 1)
+        start = time.perf_counter()
+        sim.step(1/recorded.rate, inputs)
+        times.append(time.perf_counter() - start)
+    return {'replay': summarize(times, {'ticks': len(times)})}
+
+
+def bench_render(ticks, warmup):
+    """ Runs the real window hidden, update and on_draw included """
+    from pyglet.window import key
+    from app import AppWindow
+    import resources
+
+    window = AppWindow(1024, 768, 'Sky Fight', visible = False)
+    resources.manager.wait()
+    window.update(0)
+    window.player.pause()
+    window.set_state(window.states['PLAYING'])
+    window.key_handler.on_key_press(key.Z, 0)
+    times = []
+    draws = []
+    for tick in range(warmup + ticks):
+        window.game.enemy.health = PHASES['phase3']
+        window.game.player.lives = 3
+        start = time.perf_counter()
+        window.update(DT)
+        updated = time.perf_counter()
+        window.switch_to()
+        window.dispatch_event('on_draw')
+        window.flip()
+        if tick >= warmup:
+            times.append(time.perf_counter() - start)
+            draws.append(time.perf_counter() - updated)
+    window.close()
+    return {'render_phase3': summarize(times, {'draw_p50_ms': 1000*percentile(draws, 50)})}
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values)*p/100))]
+
+
+def summarize(times, extra):
+    result = {
+        'ticks_per_s': len(times)/sum(times),
+        'p50_ms': 1000*percentile(times, 50),
+        'p99_ms': 1000*percentile(times, 99),
+    }
+    result.update(extra)
+    return result
+
+
+def compare(results, baseline, tolerance):
+    """ Returns the scenarios whose p50 got slower than the baseline by more than tolerance """
+    regressions = []
+    for name, result in results.items():
+        if name in baseline and result['p50_ms'] > baseline[name]['p50_ms']*(1 + tolerance):
+            regressions.append((name, baseline[name]['p50_ms'], result['p50_ms']))
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Benchmarks the Sky Fight hot paths')
+    parser.add_argument('--ticks', type = int, default = 600, help = 'measured ticks per scenario')
+    parser.add_argument('--warmup', type = int, default = 480, help = 'ticks to fill the field before measuring')
+    parser.add_argument('--render', action = 'store_true', help = 'also time update and draw in a hidden window')
+    parser.add_argument('--replay', help = 'also time the playback of a recorded run')
+    parser.add_argument('--out', default = 'benchmark.json', help = 'where the results are written')
+    parser.add_argument('--compare', help = 'an earlier results file to check for regressions')
+    parser.add_argument('--tolerance', type = float, default = 0.1, help = 'allowed p50 slowdown against --compare')
+    args = parser.parse_args()
+
+    results = {}
+    for phase in PHASES:
+        for density in DENSITIES:
+            name = phase + '_' + density
+            results[name] = bench_simulation(phase, DENSITIES[density], args.ticks, args.warmup)
+            r = results[name]
+            print(f'{name:12} {r["ticks_per_s"]:9.0f} ticks/s  p50 {r["p50_ms"]:7.3f} ms  p99 {r["p99_ms"]:7.3f} ms  '
+                  f'{r["bullets"]:7.0f} bullets  {r["alloc_kib_per_tick"]:8.1f} KiB/tick  {r["peak_mib"]:6.1f} MiB peak')
+    results.update(bench_emitters(args.ticks))
+    results.update(bench_savestates(args.ticks, args.warmup))
+    if args.replay:
+        results.update(bench_replay(args.replay))
+    if args.render:
+        results.update(bench_render(args.ticks, args.warmup))
+
+    with open(args.out, 'w') as out:
+        json.dump({'python': sys.version.split()[0], 'time': time.time(), 'results': results}, out, indent = 2)
+
+    if args.compare:
+        with open(args.compare) as baseline:
+            regressions = compare(results, json.load(baseline)['results'], args.tolerance)
+        for name, before, after in regressions:
+            print(f'regression: {name} p50 {before:.3f} ms -> {after:.3f} ms')
+        sys.exit(1 if regressions else 0)
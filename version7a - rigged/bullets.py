@@ -0,0 +1,262 @@
+import collections
+import math
+import numpy as np
+import pyglet
+
+
+# bullet kinds, each one indexes the image list given to a BulletRenderer
+PLAYER_LASER = 0
+CIRCLE = 1
+CIRCLE_WHITE = 2
+OVAL = 3
+
+# what a BulletRenderer reads of a store, copied so it can be drawn while the store moves on
+BulletFrame = collections.namedtuple('BulletFrame', ['count', 'x', 'y', 'prev_x', 'prev_y', 'rotation', 'scale', 'kind'])
+
+
+class BulletRenderer:
+    """ Draws every bullet of a store with one vertex list per kind, the quads are worked out from the store's arrays and copied in one go """
+    def __init__(self, store, images, batch, groups):
+        # groups gives the draw layer of every kind
+        self.store = store
+        self.images = images
+        self.batch = batch
+        self.groups = groups
+        self.lists = [None]*len(images)
+        self.drawn = [0]*len(images)
+        self.limit = None               # most bullets drawn, None draws them all
+
+
+    def vertex_list(self, kind, needed):
+        """ Returns the vertex list of a kind with room for at least needed quads """
+        vertex_list = self.lists[kind]
+        capacity = vertex_list.get_size()//4 if vertex_list is not None else 0
+        if needed <= capacity:
+            return vertex_list
+
+        capacity = max(capacity, 64)
+        while capacity < needed:
+            capacity *= 2
+        image = self.images[kind]
+        if vertex_list is None:
+            group = pyglet.sprite.SpriteGroup(image.get_texture(), pyglet.gl.GL_SRC_ALPHA, pyglet.gl.GL_ONE_MINUS_SRC_ALPHA, self.groups[kind])
+            vertex_list = self.batch.add(4*capacity, pyglet.gl.GL_QUADS, group, 'v2f/stream', 't3f/static', 'c4B/static')
+            self.lists[kind] = vertex_list
+        else:
+            vertex_list.resize(4*capacity)
+        vertex_list.tex_coords[:] = image.tex_coords*capacity
+        vertex_list.colors[:] = (255,)*16*capacity
+        np.ctypeslib.as_array(vertex_list.vertices)[:] = 0
+        return vertex_list
+
+
+    def sync(self, alpha, frame = None):
+        """ Places every quad alpha of the way from the previous tick to the current one, of a BulletFrame if given instead of the store """
+        store = self.store if frame is None else frame
+        n = store.count if self.limit is None else min(store.count, self.limit)
+        x = store.prev_x[:n] + (store.x[:n] - store.prev_x[:n])*alpha
+        y = store.prev_y[:n] + (store.y[:n] - store.prev_y[:n])*alpha
+        kinds = store.kind[:n]
+
+        for kind, image in enumerate(self.images):
+            chosen = np.flatnonzero(kinds == kind)
+            m = len(chosen)
+            if m == 0 and self.drawn[kind] == 0:
+                continue
+
+            # the corners of every quad, rotated and scaled about the image's anchor the way a sprite is
+            scale = store.scale[chosen]
+            x1 = -image.anchor_x*scale
+            y1 = -image.anchor_y*scale
+            x2 = x1 + image.width*scale
+            y2 = y1 + image.height*scale
+            radians = -np.radians(store.rotation[chosen])
+            cr = np.cos(radians)
+            sr = np.sin(radians)
+            cx = x[chosen]
+            cy = y[chosen]
+            quads = np.empty((m, 8), dtype=np.float32)
+            quads[:, 0] = x1*cr - y1*sr + cx
+            quads[:, 1] = x1*sr + y1*cr + cy
+            quads[:, 2] = x2*cr - y1*sr + cx
+            quads[:, 3] = x2*sr + y1*cr + cy
+            quads[:, 4] = x2*cr - y2*sr + cx
+            quads[:, 5] = x2*sr + y2*cr + cy
+            quads[:, 6] = x1*cr - y2*sr + cx
+            quads[:, 7] = x1*sr + y2*cr + cy
+
+            # the quads left over from a busier frame collapse to nothing
+            vertices = np.ctypeslib.as_array(self.vertex_list(kind, m).vertices)
+            vertices[:8*m] = quads.ravel()
+            vertices[8*m:8*self.drawn[kind]] = 0
+            self.drawn[kind] = m
+
+
+    def quads(self):
+        return sum(self.drawn)
+
+
+
+class BulletStore:
+    """ Every bullet of one side, kept as parallel numpy arrays instead of one object per bullet """
+    def __init__(self, capacity=256):
+        self.count = 0
+
+        self.x = np.zeros(capacity)
+        self.y = np.zeros(capacity)
+        self.prev_x = np.zeros(capacity)
+        self.prev_y = np.zeros(capacity)
+        self.velx = np.zeros(capacity)
+        self.vely = np.zeros(capacity)
+        self.radius = np.zeros(capacity)
+        self.rotation = np.zeros(capacity)
+        self.scale = np.ones(capacity)
+        self.kind = np.zeros(capacity, dtype=np.int8)
+        self.alive = np.zeros(capacity, dtype=bool)
+
+        # every bullet keeps the id it was given when added, so it can be told apart across ticks
+        self.ids = np.zeros(capacity, dtype=np.int64)
+        self.next_id = 0
+        self.columns = ['x', 'y', 'prev_x', 'prev_y', 'velx', 'vely', 'radius', 'rotation', 'scale', 'kind', 'alive', 'ids']
+
+
+    def __len__(self):
+        return self.count
+
+
+    def grow(self, needed):
+        """ Makes room for at least needed bullets """
+        capacity = len(self.x)
+        if needed <= capacity:
+            return
+        while capacity < needed:
+            capacity *= 2
+        for name in self.columns:
+            old = getattr(self, name)
+            new = np.zeros(capacity, dtype=old.dtype)
+            new[:self.count] = old[:self.count]
+            setattr(self, name, new)
+
+
+    def emit(self, x, y, vel, rotation, scale, radius, kind):
+        """ Adds a volley of bullets, every argument may be a scalar or an array """
+        # rotation is given in degrees clockwise from the +y axis
+        radians = np.radians(rotation)
+        velx = vel*np.cos(math.pi/2 - radians)
+        vely = vel*np.sin(math.pi/2 - radians)
+        return self.append(x, y, velx, vely, rotation, scale, radius, kind)
+
+
+    def append(self, x, y, velx, vely, rotation, scale, radius, kind, ids = None):
+        """ Adds a volley whose velocities are already known, new ids are given out unless ids are passed """
+        x, y, velx, vely, rotation, scale, radius, kind = np.broadcast_arrays(x, y, velx, vely, rotation, scale, radius, kind)
+        size = x.size
+        if size == 0:
+            return 0
+
+        start = self.count
+        end = start + size
+        self.grow(end)
+
+        self.x[start:end] = x
+        self.y[start:end] = y
+        self.prev_x[start:end] = x
+        self.prev_y[start:end] = y
+        self.velx[start:end] = velx
+        self.vely[start:end] = vely
+        self.radius[start:end] = radius
+        self.rotation[start:end] = rotation
+        self.scale[start:end] = scale
+        self.kind[start:end] = kind
+        self.alive[start:end] = True
+        if ids is None:
+            self.ids[start:end] = np.arange(self.next_id, self.next_id + size)
+            self.next_id += size
+        else:
+            self.ids[start:end] = ids
+        self.count = end
+        return size
+
+
+    def update(self, dt, bounds = (1024, 768)):
+        """ Moves every bullet in one step and drops the ones that left the screen """
+        n = self.count
+        if n == 0:
+            return
+        x = self.x[:n]
+        y = self.y[:n]
+        self.prev_x[:n] = x
+        self.prev_y[:n] = y
+        x += self.velx[:n]*dt
+        y += self.vely[:n]*dt
+        self.alive[:n] &= (x >= 0) & (x <= bounds[0]) & (y >= 0) & (y <= bounds[1])
+        self.compact()
+
+
+    def frame(self):
+        """ Returns a read-only copy of what drawing needs """
+        n = self.count
+        columns = []
+        for name in BulletFrame._fields[1:]:
+            column = getattr(self, name)[:n].copy()
+            column.flags.writeable = False
+            columns.append(column)
+        return BulletFrame(n, *columns)
+
+
+    def distance_squared(self, x, y):
+        """ Returns the squared distance of every bullet to a point """
+        n = self.count
+        dx = self.x[:n] - x
+        dy = self.y[:n] - y
+        return dx*dx + dy*dy
+
+
+    def closest_approach(self, x, y, velx = 0, vely = 0, horizon = 1, indices = None):
+        """ Returns when, within horizon seconds, every bullet is closest to a point moving from x, y at velx, vely, and the squared distance then """
+        # the point's position and velocity may be arrays of shape (m, 1), which gives (m, count) answers at once
+        rows = slice(0, self.count) if indices is None else indices
+        dx = self.x[rows] - x
+        dy = self.y[rows] - y
+        wx = self.velx[rows] - velx
+        wy = self.vely[rows] - vely
+        speed_squared = wx*wx + wy*wy
+        t = -(dx*wx + dy*wy)/np.where(speed_squared > 0, speed_squared, 1)
+        t = np.clip(t, 0, horizon)
+        ex = dx + wx*t
+        ey = dy + wy*t
+        return (t, ex*ex + ey*ey)
+
+
+    def threats(self, x, y, radius, ticks, dt, velx = 0, vely = 0):
+        """ Returns the indices of the bullets that come within radius of the point in the next ticks, and the seconds until they are closest """
+        t, distance_squared = self.closest_approach(x, y, velx, vely, ticks*dt)
+        reach = radius + self.radius[:self.count]
+        hits = np.flatnonzero(distance_squared <= reach*reach)
+        return (hits, t[hits])
+
+
+    def remove(self, indices):
+        """ Removes the bullets at the given indices right away """
+        self.alive[indices] = False
+        self.compact()
+
+
+    def compact(self):
+        """ Packs the alive bullets to the front of the arrays """
+        n = self.count
+        keep = self.alive[:n]
+        if keep.all():
+            return
+
+        kept = np.flatnonzero(keep)
+        for name in self.columns:
+            column = getattr(self, name)
+            column[:len(kept)] = column[kept]
+        self.alive[len(kept):n] = False
+        self.count = len(kept)
+
+
+    def clear(self):
+        self.alive[:self.count] = False
+        self.compact()
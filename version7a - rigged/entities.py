@@ -0,0 +1,272 @@
+import numpy as np
+
+
+# a handle keeps the generation of its slot above the slot, so the handle of a despawned entity never matches the slot's next tenant
+SLOT_BITS = 32
+SLOT_MASK = (1 << SLOT_BITS) - 1
+
+# the phase health of an enemy whose firing phase has to be worked out again
+UNPHASED = np.iinfo(np.int64).min
+
+# up to this many enemy and bullet pairs testing every pair beats setting up the grid
+DENSE_PAIRS = 16384
+
+
+class EntityStore:
+    """ Entities of one archetype as parallel numpy arrays, each reachable through a handle that stays valid while rows move """
+    def __init__(self, columns, objects = (), capacity = 16):
+        # columns maps every array to its dtype, objects names the per-entity Python values kept in lists
+        self.columns = dict(columns)
+        self.objects = list(objects) + ['view']
+        self.count = 0
+        for name, dtype in self.columns.items():
+            setattr(self, name, np.zeros(capacity, dtype=dtype))
+        for name in self.objects:
+            setattr(self, name, [])
+
+        self.slot = np.zeros(capacity, dtype=np.int64)         # the slot of every row
+        self.rows = np.zeros(0, dtype=np.int64)                 # the row of every slot, -1 once it is free
+        self.generation = np.zeros(0, dtype=np.int64)
+        self.free = []
+
+
+    def __len__(self):
+        return self.count
+
+
+    def grow(self, needed):
+        capacity = len(self.slot)
+        if needed <= capacity:
+            return
+        while capacity < needed:
+            capacity *= 2
+        for name in list(self.columns) + ['slot']:
+            old = getattr(self, name)
+            new = np.zeros(capacity, dtype=old.dtype)
+            new[:self.count] = old[:self.count]
+            setattr(self, name, new)
+
+
+    def spawn(self, count, **values):
+        """ Adds count entities, a column value may be a scalar or an array and an object value a scalar or a list, returns their handles """
+        start = self.count
+        end = start + count
+        self.grow(end)
+
+        reused = [self.free.pop() for _ in range(min(count, len(self.free)))]
+        fresh = np.arange(len(self.rows), len(self.rows) + count - len(reused))
+        self.rows = np.concatenate([self.rows, np.full(len(fresh), -1, dtype=np.int64)])
+        self.generation = np.concatenate([self.generation, np.zeros(len(fresh), dtype=np.int64)])
+        slots = np.concatenate([np.array(reused, dtype=np.int64), fresh])
+
+        self.slot[start:end] = slots
+        self.rows[slots] = np.arange(start, end)
+        for name in self.columns:
+            getattr(self, name)[start:end] = values.get(name, 0)
+        for name in self.objects:
+            value = values.get(name)
+            getattr(self, name).extend(value if isinstance(value, list) else [value]*count)
+        self.count = end
+        return (self.generation[slots] << SLOT_BITS) | slots
+
+
+    def row(self, handle):
+        """ Returns the row of an entity, -1 once it is despawned """
+        slot = handle & SLOT_MASK
+        if slot >= len(self.rows) or self.generation[slot] != handle >> SLOT_BITS:
+            return -1
+        return int(self.rows[slot])
+
+
+    def despawn(self, handles):
+        """ Removes entities for good, the rest keep their order and their handles """
+        gone = np.array([row for row in (self.row(handle) for handle in handles) if row >= 0], dtype=np.int64)
+        if len(gone) == 0:
+            return
+        keep = np.ones(self.count, dtype=bool)
+        keep[gone] = False
+        kept = np.flatnonzero(keep)
+
+        freed = self.slot[gone]
+        self.generation[freed] += 1
+        self.rows[freed] = -1
+        self.free.extend(freed.tolist())
+        for row in gone:
+            if self.view[row] is not None:
+                self.view[row].row = -1
+
+        for name in list(self.columns) + ['slot']:
+            column = getattr(self, name)
+            column[:len(kept)] = column[kept]
+        for name in self.objects:
+            values = getattr(self, name)
+            setattr(self, name, [values[i] for i in kept])
+        self.count = len(kept)
+
+        # rows moved up, so does every view
+        self.rows[self.slot[:self.count]] = np.arange(self.count)
+        for row, view in enumerate(self.view):
+            if view is not None:
+                view.row = row
+
+
+
+class Column:
+    """ An attribute of an entity view that is really its row in one of the store's arrays """
+    def __set_name__(self, owner, name):
+        self.name = name
+
+
+    def __get__(self, view, owner = None):
+        if view is None:
+            return self
+        if view.row < 0:
+            raise LookupError(f'{self.name} of a despawned entity')
+        return getattr(view.store, self.name)[view.row].item()
+
+
+    def __set__(self, view, value):
+        if view.row < 0:
+            raise LookupError(f'{self.name} of a despawned entity')
+        getattr(view.store, self.name)[view.row] = value
+
+
+
+ENEMY_COLUMNS = {
+    'x': float, 'y': float, 'prev_x': float, 'prev_y': float, 'velx': float, 'vely': float,
+    'health': np.int64, 'start_health': np.int64, 'hitbox_radius': float,
+    'boss_id': np.int64, 'phase': np.int64, 'phase_health': np.int64,
+    'active': bool,         # still in the match
+}
+
+
+class Enemies(EntityStore):
+    """ Every enemy of a match, moved, put in their phase and fired for all of them at once """
+    def __init__(self, capacity = 16):
+        super().__init__(ENEMY_COLUMNS, capacity = capacity)
+        # the compiled bosses the enemies use, boss_id indexes them, and the ticks between volleys of all their patterns
+        self.bosses = []
+        self.periods = set()
+
+
+    def register(self, boss):
+        if boss not in self.bosses:
+            self.bosses.append(boss)
+            self.periods.update(emitter.every for emitter in boss.patterns.values())
+        return self.bosses.index(boss)
+
+
+    def spawn_enemies(self, x, y, boss, health, radius, vely = -1):
+        """ Adds a group of enemies, x and y may be arrays, returns their handles """
+        x, y = np.broadcast_arrays(np.asarray(x, dtype=float), np.asarray(y, dtype=float))
+        return self.spawn(x.size, x = x.ravel(), y = y.ravel(), prev_x = x.ravel(), prev_y = y.ravel(), vely = vely,
+                          health = health, start_health = health, hitbox_radius = radius,
+                          boss_id = self.register(boss), phase = -1, phase_health = UNPHASED, active = True)
+
+
+    def active_rows(self):
+        return np.flatnonzero(self.active[:self.count])
+
+
+    def update(self, dt, rows = None, bounds = None, margin = 100):
+        """ Moves every active enemy, or the given rows, and looks up the phase of the ones whose health changed """
+        # returns the enemies that flew more than margin off the bounds, they are out of the match
+        n = self.count
+        if rows is None and self.active[:n].all():
+            # the usual case works on views of the arrays instead of copies
+            rows = slice(0, n)
+            x = self.x[:n]
+            y = self.y[:n]
+            velx = self.velx[:n]
+            np.sin(y/10, out = velx)
+            velx *= 10
+            self.prev_x[:n] = x
+            self.prev_y[:n] = y
+            x += velx*dt
+            y += self.vely[:n]*dt
+        else:
+            rows = self.active_rows() if rows is None else rows
+            y = self.y[rows]
+            velx = 10*np.sin(y/10)
+            self.velx[rows] = velx
+            self.prev_x[rows] = self.x[rows]
+            self.prev_y[rows] = y
+            x = self.x[rows] + velx*dt
+            y = y + self.vely[rows]*dt
+            self.x[rows] = x
+            self.y[rows] = y
+
+        # enemy wrecks havoc when hp is low, the phase is only looked up again once the hp changes
+        changed = self.health[rows] != self.phase_health[rows]
+        if changed.any():
+            for row in np.arange(n)[rows][changed]:
+                health = int(self.health[row])
+                self.phase_health[row] = health
+                self.phase[row] = self.bosses[self.boss_id[row]].phase_index(health, int(self.start_health[row]))
+
+        if bounds is None or len(x) == 0:
+            return []
+        width, height = bounds
+        if x.min() >= -margin and x.max() <= width + margin and y.min() >= -margin and y.max() <= height + margin:
+            return []
+        rows = np.arange(n)[rows]
+        gone = rows[(x < -margin) | (x > width + margin) | (y < -margin) | (y > height + margin)]
+        self.active[gone] = False
+        return [self.view[row] for row in gone]
+
+
+    def fire(self, target, tick, bullets, rows = None):
+        """ Fires the patterns of every active enemy at target, enemies of the same boss and phase fire each pattern together """
+        if target.lives < 0 or all(tick%period for period in self.periods):
+            return 0
+        rows = self.active_rows() if rows is None else rows
+        rows = rows[(self.health[rows] > 0) & (self.phase[rows] >= 0)]
+        if len(rows) == 0:
+            return 0
+
+        fired = 0
+        keys = (self.boss_id[rows] << 16) | self.phase[rows]
+        groups = [keys[0]] if (keys == keys[0]).all() else np.unique(keys)
+        for key in groups:
+            emitters = [emitter for emitter in self.bosses[key >> 16].phases[key & 0xFFFF][1] if tick%emitter.every == 0]
+            if not emitters:
+                continue
+            shooters = rows[keys == key]
+            x = self.x[shooters]
+            y = self.y[shooters]
+            for emitter in emitters:
+                fired += emitter.fire_many(x, y, target, tick, bullets)
+        return fired
+
+
+    def hits(self, bullets, grid):
+        """ Returns (row, indices) of every active enemy touched by bullets of the store, the indices in bullet order
+
+        A few enemies test every bullet, many of them build the SpatialGrid on the bullets and only test the cells they overlap.
+        """
+        n = self.count
+        m = len(bullets)
+        if n == 0 or m == 0:
+            return []
+        if n*m <= DENSE_PAIRS:
+            rows = self.active_rows()
+            dx = bullets.x[:m] - self.x[rows, None]
+            dy = bullets.y[:m] - self.y[rows, None]
+            reach = bullets.radius[:m] + self.hitbox_radius[rows, None]
+            touching = dx*dx + dy*dy < reach*reach
+            struck = touching.any(axis = 1)
+            return [(row, np.flatnonzero(touched)) for row, touched in zip(rows[struck].tolist(), touching[struck])]
+
+        # only the enemies near a bullet are looked at one by one
+        grid.build(bullets)
+        if self.active[:n].all():
+            near = np.flatnonzero(grid.occupied(self.x[:n], self.y[:n], self.hitbox_radius[:n] + grid.max_radius))
+        else:
+            rows = self.active_rows()
+            near = rows[grid.occupied(self.x[rows], self.y[rows], self.hitbox_radius[rows] + grid.max_radius)]
+        touched = []
+        for row in near.tolist():
+            hits = grid.hits(float(self.x[row]), float(self.y[row]), float(self.hitbox_radius[row]))
+            if len(hits) > 0:
+                touched.append((row, hits))
+        return touched
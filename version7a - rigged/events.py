@@ -0,0 +1,28 @@
+import collections
+
+
+class EventBus:
+    """ Collects what happened in the game logic, handlers only run when the queue is dispatched """
+    def __init__(self):
+        self.handlers = collections.defaultdict(list)
+        # a deque, so a simulation thread can publish while the main thread dispatches
+        self.queue = collections.deque()
+
+
+    def subscribe(self, kind, handler):
+        self.handlers[kind].append(handler)
+
+
+    def publish(self, kind, **data):
+        # events nobody listens to are not even kept
+        if kind in self.handlers:
+            self.queue.append((kind, data))
+
+
+    def dispatch(self):
+        """ Hands every queued event to its handlers, in the order they were published """
+        # events published by the handlers wait for the next dispatch
+        for _ in range(len(self.queue)):
+            kind, data = self.queue.popleft()
+            for handler in self.handlers[kind]:
+                handler(**data)
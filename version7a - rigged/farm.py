@@ -0,0 +1,172 @@
+import argparse
+import itertools
+import json
+import multiprocessing
+import os
+import random
+import statistics
+import time
+
+# sets up pyglet for running without a window, before anything else imports it
+from headless import ScriptedInput, create_simulation, strafe_script
+from autopilot import Autopilot
+from benchmark import percentile
+
+from pyglet.window import key
+
+
+# the arrow keys a random policy picks from
+MOVES = [[], [key.LEFT], [key.RIGHT], [key.UP], [key.DOWN], [key.LEFT, key.UP], [key.RIGHT, key.UP], [key.LEFT, key.DOWN], [key.RIGHT, key.DOWN]]
+
+
+def random_script(ticks, seed):
+    """ Holds a random direction for a random while, firing most of the time and focusing now and then """
+    rng = random.Random(seed)
+    script = []
+    tick = 0
+    while tick < ticks:
+        keys = list(rng.choice(MOVES))
+        if rng.random() < 0.9:
+            keys.append(key.Z)
+        if rng.random() < 0.3:
+            keys.append(key.LSHIFT)
+        script.append((tick, keys))
+        tick += rng.randint(10, 60)
+    return script
+
+
+# what plays the match, given the simulation, the tick limit and the seed
+POLICIES = {
+    'strafe': lambda sim, ticks, seed: ScriptedInput(strafe_script(ticks)),
+    'random': lambda sim, ticks, seed: ScriptedInput(random_script(ticks, seed)),
+    'autopilot': lambda sim, ticks, seed: Autopilot(sim, sim.player),
+}
+
+
+def configure(sim, overrides):
+    """ Applies overrides like {'enemy.health': 1200, 'sim.graze_score': 50, 'boss.phases.1.hp': 600} to a new match """
+    owners = {'sim': [sim], 'player': sim.players, 'enemy': sim.enemies}
+
+    # boss settings are paths into the pattern definition, which is compiled again with all of them changed
+    tuning = {name.partition('.')[2]: value for name, value in overrides.items() if name.startswith('boss.')}
+    if tuning:
+        boss = sim.enemy.boss.tuned(tuning)
+        for enemy in sim.enemies:
+            enemy.boss = boss
+
+    for name, value in overrides.items():
+        owner, _, attribute = name.partition('.')
+        if owner == 'boss':
+            continue
+        for target in owners[owner]:
+            if not hasattr(target, attribute):
+                raise AttributeError(f'{name} is not a setting of the {owner}')
+            setattr(target, attribute, tuple(value) if isinstance(value, list) else value)
+            if owner == 'enemy' and attribute == 'health':
+                target.start_health = value
+
+
+def play_match(job):
+    """ Plays one match to the end, returns its record, runs in a worker process """
+    config, overrides, policy, seed, max_ticks = job
+    sim = create_simulation()
+    configure(sim, overrides)
+    inputs = POLICIES[policy](sim, max_ticks, seed)
+
+    start = time.perf_counter()
+    grazes = 0
+    killed_at = None
+    while not sim.over and sim.tick_counter < max_ticks:
+        inputs.advance(sim.tick_counter + 1)
+        grazes += sim.step(1/120, inputs).grazes
+        if killed_at is None and sim.won:
+            killed_at = sim.tick_counter
+    sim.finish()
+
+    return {
+        'config': config,
+        'policy': policy,
+        'seed': seed,
+        'won': sim.won,
+        'score': sim.score,
+        'ticks': sim.tick_counter,
+        'time_to_kill': killed_at,
+        'enemy_health': sim.enemy.health,
+        'lives': sim.player.lives,
+        'grazes': grazes,
+        'seconds': time.perf_counter() - start,
+    }
+
+
+def summarize(records):
+    """ Returns the aggregate of every configuration, by name """
+    by_config = {}
+    for record in records:
+        by_config.setdefault(record['config'], []).append(record)
+
+    summary = {}
+    for config, runs in by_config.items():
+        scores = [run['score'] for run in runs]
+        kills = [run['time_to_kill'] for run in runs if run['time_to_kill'] is not None]
+        summary[config] = {
+            'matches': len(runs),
+            'win_rate': len(kills)/len(runs),
+            'score_mean': statistics.mean(scores),
+            'score_p10': percentile(scores, 10),
+            'score_p50': percentile(scores, 50),
+            'score_p90': percentile(scores, 90),
+            'time_to_kill_mean': statistics.mean(kills)/120 if kills else None,
+            'time_to_kill_p50': percentile(kills, 50)/120 if kills else None,
+            'grazes_mean': statistics.mean(run['grazes'] for run in runs),
+        }
+    return summary
+
+
+def configurations(grid, config_file):
+    """ Returns (name, overrides) pairs, from a file of named configurations and every combination of the grid """
+    configs = []
+    if config_file:
+        with open(config_file) as configs_in:
+            configs.extend(json.load(configs_in).items())
+    if grid:
+        names = [name for name, values in grid]
+        for values in itertools.product(*[values for name, values in grid]):
+            overrides = dict(zip(names, values))
+            configs.append((' '.join(f'{name}={json.dumps(value)}' for name, value in overrides.items()), overrides))
+    return configs or [('default', {})]
+
+
+def parse_grid(option):
+    """ 'sim.graze_score=25,50' becomes ('sim.graze_score', [25, 50]), a value may be any JSON like [-90,90] """
+    name, _, values = option.partition('=')
+    return (name, json.loads('[' + values + ']'))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Plays many headless Sky Fight matches in parallel for balance runs')
+    parser.add_argument('--set', dest = 'grid', type = parse_grid, action = 'append', help = 'a setting and the values to try, e.g. sim.graze_score=25,50 or boss.patterns.pattern1.every=12,15')
+    parser.add_argument('--configs', help = 'a JSON file of {name: {setting: value}}')
+    parser.add_argument('--matches', type = int, default = 100, help = 'matches per configuration')
+    parser.add_argument('--policy', choices = list(POLICIES), default = 'random')
+    parser.add_argument('--seed', type = int, default = 0)
+    parser.add_argument('--ticks', type = int, default = 20000, help = 'a match that lasts longer is cut off')
+    parser.add_argument('--workers', type = int, default = os.cpu_count())
+    parser.add_argument('--out', default = 'farm.jsonl', help = 'every finished match is appended here')
+    args = parser.parse_args()
+
+    jobs = [(name, overrides, args.policy, args.seed + i, args.ticks) for name, overrides in configurations(args.grid, args.configs) for i in range(args.matches)]
+
+    start = time.perf_counter()
+    records = []
+    with multiprocessing.Pool(args.workers) as pool, open(args.out, 'a') as out:
+        for record in pool.imap_unordered(play_match, jobs, chunksize = max(1, len(jobs)//(8*args.workers))):
+            out.write(json.dumps(record) + '\n')
+            out.flush()
+            records.append(record)
+    elapsed = time.perf_counter() - start
+    print(f'{len(records)} matches in {elapsed:.1f} s on {args.workers} workers, {sum(r["ticks"] for r in records)/elapsed:.0f} ticks/s')
+
+    for config, s in summarize(records).items():
+        ttk = f'{s["time_to_kill_p50"]:6.1f} s' if s['time_to_kill_p50'] is not None else '     -  '
+        print(f'{config:40} win {100*s["win_rate"]:5.1f}%  score p10 {s["score_p10"]:8}  p50 {s["score_p50"]:8}  p90 {s["score_p90"]:8}  '
+              f'time to kill p50 {ttk}  grazes {s["grazes_mean"]:6.1f}')
@@ -1,7 +1,19 @@
+import time
+
 import pyglet
 from pyglet.window import key
-from utils import Player, Enemy, Bullet, UtilityFunctions
+from utils import UtilityFunctions, NullSprite
+from bullets import BulletRenderer, PLAYER_LASER
+from simulation import Simulation
+from audio import AudioManager
+from hud import HUD
+from autopilot import Autopilot
+from waves import WaveScript, WAVES
+from simthread import capture
+import replay
+import savestate
 import resources
+import layers
 
 
 class Game:
@@ -10,185 +22,284 @@ class Game:
         self.center_x, self.center_y = (window.width//2, window.height//2)
         self.key_handler = self.window.key_handler
 
-        # create the elements of the game
-        self.player, self.enemy = self.create_player_enemy()
-        self.players = [self.player]
-        self.enemies = [self.enemy]
-        self.player_bullets = []
-        self.enemy_bullets = []
+        # prebuilt batches, a state only picks which of them are drawn and the layers give their draw order
+        self.world_batch = pyglet.graphics.Batch()
+        self.bullet_batch = pyglet.graphics.Batch()
+        self.playing_batch = pyglet.graphics.Batch()
+        self.game_over_batch = pyglet.graphics.Batch()
+        self.background = pyglet.sprite.Sprite(resources.background_image, x = -425, batch = self.world_batch, group = layers.BACKGROUND)
+
+        # create the elements of the game, the simulation owns them
+        self.sim = Simulation(window.width, window.height, resources.player_image_sprite, resources.enemy_image_sprite)
+        self.audio = AudioManager(self.sim.events, resources)
+
+        # enemies sent in by a wave script get sprites of their own, and leave the screen when downed or gone
+        # on a simulation thread no sprite may be made, they get theirs once the main thread draws them
+        self.threaded = window.threaded
+        self.sim.make_sprite = NullSprite if self.threaded else self.create_enemy_sprite
+        if window.waves is not None:
+            self.sim.waves = WaveScript(WAVES[window.waves])
+        self.sim.events.subscribe('enemy_defeated', self.hide_enemy)
+        self.sim.events.subscribe('drone_downed', self.hide_enemy)
+        self.sim.events.subscribe('enemy_left', self.hide_enemy)
+
+        # every tick's keys are logged, a finished match is saved as a replay
+        self.recorder = replay.Recorder(round(1/window.timestep.step))
+        self.replay_file = None
+
+        # snapshots of the last seconds of the match to rewind to, alone only since a co-op match belongs to the host
+        self.savestates = savestate.SaveStates()
+        self.player, self.enemy = (self.sim.player, self.sim.enemy)
+        self.players = self.sim.players
+        self.enemies = self.sim.enemies
+        self.all_enemies = self.sim.all_enemies
+
+        # the ship sprites are shared by every Game, so they are put back in the world batch and shown again
+        self.player.sprite.batch = self.world_batch
+        self.player.sprite.group = layers.PLAYER
+        self.player.sprite.visible = True
+        for enemy in self.all_enemies:
+            enemy.sprite.batch = self.world_batch
+            enemy.sprite.group = layers.ENEMIES
+            enemy.sprite.visible = True
+        self.player_bullets = self.sim.player_bullets
+        self.enemy_bullets = self.sim.enemy_bullets
+
+        # bullets have no sprites, every kind is drawn from one vertex list refreshed from the store each frame
+        bullet_layers = [layers.PLAYER_BULLETS if kind == PLAYER_LASER else layers.ENEMY_BULLETS for kind in range(len(resources.bullet_images))]
+        self.bullet_renderers = [BulletRenderer(store, resources.bullet_images, self.bullet_batch, bullet_layers)
+                                 for store in [self.player_bullets, self.enemy_bullets]]
+
+        # in co-op the host runs the match for both players, a client only mirrors what the host sends
+        self.net = window.net
+        self.mirror = self.net is not None and not self.net.authoritative
+        self.local_player = self.player
+        if self.net is not None:
+            partner_sprite = pyglet.sprite.Sprite(resources.player_image, batch = self.world_batch, group = layers.PLAYER)
+            partner_sprite.scale = 0.3
+            partner_sprite.color = (150, 200, 255)
+            partner = self.sim.add_player(partner_sprite, self.net.remote)
+            self.local_player = partner if self.mirror else self.player
+            self.net.attach(self.sim)
 
         # hud for heads up display
-        self.game_hud_labels, self.game_hud_buttons = self.create_game_hud()
+        self.hud, self.game_hud_buttons = self.create_game_hud()
+        self.hud.set_batch(self.world_batch)
+        self.hud_interval = 1           # ticks between hud writes, raised by the governor under load
+        self.hud_countdown = 0
+        self.hud_tick = None            # the tick the hud shows, on a simulation thread
         self.game_over_labels, self.game_over_buttons = self.create_game_over_screen()
+        self.current_buttons = []
 
-        # set up batch for the game
-        self.game_batch = pyglet.graphics.Batch()
-        self.current_batch = dict()
-        self.current_batch['player'] = [self.player]
-        self.current_batch['enemies'] = [self.enemy]
-        self.current_batch['player_bullets'] = []
-        self.current_batch['enemy_bullets'] = []
-        self.current_batch['labels'] = self.game_hud_labels
-        self.current_batch['buttons'] = self.game_hud_buttons
-        self.current_state = self.window.state
-
-        # set up tick control and bonus
-        self.tick_counter = 0
-        self.score_timebonus = 750000
-
-
-    def check_collision(self):
-
-        # when player bullets hit the enemy
-        for bullet in self.player_bullets:
-            if UtilityFunctions.distance(bullet.x, bullet.y, self.enemy.x, self.enemy.y) < (bullet.hitbox_radius + self.enemy.hitbox_radius) and self.enemy in self.enemies:
-                self.enemy.health -= 1
-                self.player_bullets.remove(bullet)
-                self.score += 3000
-                if self.enemy.health < 250:
-                    resources.damage.play()
-                if self.enemy.health <= 0:
-                    self.enemies.remove(self.enemy)
-                    #self.score += round(self.score_timebonus)
-                    resources.defeat_sound.play()
-                    self.player.invincibility = 1200
-                    break
-
-        # when enemy bullets hit the player
-        for bullet in self.enemy_bullets:
-            if UtilityFunctions.distance(bullet.x, bullet.y, self.player.x, self.player.y) < (bullet.hitbox_radius + self.player.hitbox_radius) and self.player.invincibility == 0:
-                self.player.lives -= 1
-                self.enemy_bullets.remove(bullet)
-                resources.death_sound.play()
-                self.player.invincibility = 300
-                #self.score -= 250000
-                self.player.x = self.center_x*3/4
-                self.player.y = self.center_y//3
-                break
-            if UtilityFunctions.distance(bullet.x, bullet.y, self.player.x, self.player.y) < 50:
-                self.score += 25
 
+    @property
+    def score(self):
+        return self.sim.score
 
-    def update(self, dt):
-        self.update_batch()
-        if self.current_state == self.window.states['PLAYING']:
 
-            self.tick_counter += 1
-            self.score_timebonus -= 75
+    @score.setter
+    def score(self, score):
+        self.sim.score = score
 
-            # write on the game hud
-            some_label = 'player: dead' if self.player.lives < 0 else 'PLAYER LIVES:' + str(self.player.lives)
-            self.game_hud_labels[0].text = 'ENEMY HP: ' + str(self.enemy.health)
-            self.game_hud_labels[1].text = 'LEVEL: ' + str(self.level)
-            self.game_hud_labels[2].text = some_label
-            self.game_hud_labels[3].text = 'SCORE: ' + str(self.score)
 
-            # update player and enemy and bullets
-            for player in self.players:
-                player.update(dt, self.key_handler, (0.75*self.window.width, self.window.height))
-            for enemy in self.enemies:
-                enemy.update(dt)                # the only enemy
-            for bullet in self.player_bullets:
-                bullet.update(dt)
-                if bullet.out_of_bounds((0.75*self.window.width, self.window.height)):
-                    self.player_bullets.remove(bullet)
-            for bullet in self.enemy_bullets:
-                bullet.update(dt)
-                if bullet.out_of_bounds((0.75*self.window.width, self.window.height)):
-                    self.enemy_bullets.remove(bullet)
-
-            # alive player or enemy will fire bullets
+    def update(self, dt):
+        if self.window.state == self.window.states['PLAYING']:
+            self.update_hud(self.enemy.health, self.local_player.lives, self.score)
+
+        # check game over
+        if self.tick(dt):
+            self.window.set_state(self.window.states['GAME_OVER'])
+
+
+    def update_hud(self, enemy_hp, lives, score):
+        # write on the game hud, only what changed gets redrawn
+        self.hud_countdown -= 1
+        if self.hud_countdown <= 0:
+            self.hud_countdown = self.hud_interval
+            self.hud.update(enemy_hp = enemy_hp, level = self.level, lives = lives, score = score)
+
+
+    def tick(self, dt):
+        """ Plays one tick while the match is on, returns whether it is over, this is all a SimulationThread runs """
+        if self.window.state != self.window.states['PLAYING']:
+            # keys pressed in the menus never reach a tick
+            self.key_handler.skip()
+            return False
+
+        tick = self.sim.tick_counter + 1
+        self.key_handler.advance(tick)
+        if isinstance(self.local_player.controls, Autopilot):
+            # the autopilot makes up its mind before the recorder reads its keys
+            self.local_player.controls.advance(tick)
+        if self.mirror:
+            self.net.step(dt, self.key_handler)
+        else:
+            self.step(dt)
+        self.key_handler.stepped()
+        return self.over
+
+
+    @property
+    def over(self):
+        return self.net.over if self.mirror else self.sim.over
+
+
+    def render_state(self):
+        return capture(self.sim, self.local_player, self.over)
+
+
+    def present(self, state, alpha):
+        """ Draws a RenderState of the simulation thread, with the events of its ticks, all on the main thread """
+        self.sim.events.dispatch()
+        if self.window.state == self.window.states['PLAYING'] and state.tick != self.hud_tick:
+            self.hud_tick = state.tick
+            self.update_hud(*state.hud)
+        for enemy, position in state.enemies:
+            if isinstance(enemy.sprite, NullSprite):
+                enemy.set_sprite(self.create_enemy_sprite())
+        self.sync(alpha, state)
+
+
+    def toggle_autopilot(self):
+        """ Hands the local ship to the autopilot or takes it back, not for a co-op client since its ship moves on the host """
+        if self.mirror:
+            return
+        player = self.local_player
+        player.controls = Autopilot(self.sim, player) if player.controls is None else None
+
+
+    def step(self, dt):
+        if self.net is None:
+            # the keys that move the ship, which are the autopilot's while it flies
+            self.recorder.record(self.sim.keys(self.player, self.key_handler))
+        else:
+            self.net.poll()
+        self.sim.step(dt, self.key_handler)
+        if self.net is not None:
+            self.net.send()
+        # on a simulation thread the events wait for the main thread, which plays their sounds and moves their sprites
+        if not self.threaded:
+            self.sim.events.dispatch()
+        if self.net is None:
+            self.savestates.offer(self.sim)
+
+
+    def rewind(self, seconds = 2):
+        """ Puts the match back a few seconds, the replay forgets the ticks undone """
+        if self.net is not None:
+            return
+        before = list(self.all_enemies)
+        tick = self.savestates.rewind(self.sim, round(seconds/self.window.timestep.step))
+        if tick is not None:
+            self.recorder.truncate(tick)
+            # enemies sent in after the tick rewound to are gone for good, their sprites leave the batch
+            kept = set(map(id, self.all_enemies))
+            for enemy in before:
+                if id(enemy) in kept:
+                    enemy.sprite.visible = enemy in self.enemies
+                else:
+                    enemy.sprite.delete()
+                    enemy.set_sprite(NullSprite())
+
+
+    def suspend(self, filename):
+        """ Saves the match as it is, to be resumed after a restart """
+        if self.net is None:
+            savestate.save(filename, savestate.snapshot(self.sim), self.recorder.runs, self.window.waves)
+
+
+    def resume(self, filename):
+        """ Picks up a match saved by suspend, only in a session with the same waves """
+        state, runs, waves = savestate.load(filename)
+        if waves != self.window.waves:
+            raise ValueError(f'the match was saved with waves {waves}, this session has {self.window.waves}')
+        self.recorder.ticks = savestate.restore(self.sim, state)
+        self.recorder.runs = runs
+        for enemy in self.all_enemies:
+            enemy.sprite.visible = enemy in self.enemies
+
+
+    def sync(self, alpha, state = None):
+        """ Moves the sprites to where the objects are, or were in a RenderState, alpha of the way into the next tick """
+        if state is None:
             for player in self.players:
-                self.player_bullets.extend(player.fire(dt, self.key_handler, self.tick_counter))
+                player.sync(alpha)
             for enemy in self.enemies:
-                self.enemy_bullets.extend(enemy.fire(dt, self.player, self.tick_counter))
-
-            if len(self.enemy.fire(dt, self.player, self.tick_counter)) > 0:
-                resources.enemy_attack.play()
-
-            self.check_collision()
-
-            # check game over
-            if (len(self.enemies) < 1 or self.player.lives < 0) and len(self.enemy_bullets) < 1:
-                self.window.state = self.window.states['GAME_OVER']
-
-
-    def update_batch(self):
-        if not self.window.state == self.current_state:
-            self.current_state = self.window.state
-
-            # 'unbatch' the current_batch
-            self.player.sprite.batch = None
-            for enemy in self.current_batch['enemies']:
-                enemy.sprite.batch = None
-            for label in self.current_batch['labels']:
-                label.batch = None
-            for button in self.current_batch['buttons']:
-                button.label.batch = None
-
-            # change current_batch
-            if self.current_state == self.window.states['PLAYING']:
-                self.current_batch['player'] = [self.player]
-                self.current_batch['enemies'] = self.enemies
-                self.current_batch['labels'] = self.game_hud_labels
-                self.current_batch['buttons'] = self.game_hud_buttons
-            if self.current_state == self.window.states['GAME_OVER']:
-                if self.enemy.health <=0:
-                    self.score += round(self.score_timebonus)
-                self.game_over_labels[0].text = 'You win!' if self.enemy.health <= 0 else 'You lost'
-                self.game_over_labels[1].text = 'Your score ' + str(self.score - self.score_timebonus - self.player.lives*250000) + f' timebonus {self.score_timebonus} + lives {self.player.lives}*250000' if self.enemy.health <= 0 else f'Your Score: {self.score}'
-                self.game_over_labels[2].text = f'Final Score: {self.score}' if self.enemy.health <= 0 else ''
-
-
-                self.current_batch['player'] = []
-                self.current_batch['enemies'] = self.enemies
-                self.current_batch['labels'] = self.game_hud_labels + self.game_over_labels
-                self.current_batch['buttons'] = self.game_over_buttons
-
-            # set the batch of current_batch
-            if self.current_state in [self.window.states['PLAYING'], self.window.states['GAME_OVER']]:
-                self.player.sprite.batch = self.game_batch
-                for enemy in self.current_batch['enemies']:
-                    enemy.sprite.batch = self.game_batch
-                for label in self.current_batch['labels']:
-                    label.batch = self.game_batch
-                for button in self.current_batch['buttons']:
-                    button.label.batch = self.game_batch
-
-
-    def draw(self):
-        self.game_batch.draw()
+                enemy.sync(alpha)
+            for renderer in self.bullet_renderers:
+                renderer.sync(alpha)
+            return
+
+        for player, position in zip(self.players, state.players):
+            player.sync(alpha, position)
+        for enemy, position in state.enemies:
+            enemy.sync(alpha, position)
+        for renderer, frame in zip(self.bullet_renderers, state.bullets):
+            renderer.sync(alpha, frame)
+
+
+    def enter(self, state):
+        """ Returns the batches to draw in the given state """
+        states = self.window.states
+        if state == states['PLAYING']:
+            self.current_buttons = self.game_hud_buttons
+            return [self.world_batch, self.bullet_batch, self.playing_batch]
+        if state == states['GAME_OVER']:
+            self.show_game_over()
+            self.current_buttons = self.game_over_buttons
+            return [self.world_batch, self.bullet_batch, self.game_over_batch]
+
+        # the match stays on screen behind the pause menu
+        self.current_buttons = []
+        return [self.world_batch, self.bullet_batch] if state == states['PAUSED'] else []
+
+
+    def show_game_over(self):
+        if not self.sim.finished:
+            self.sim.finish()
+            # the other player's keys are not in the log and waves are not either, so only plain single player matches are replays
+            if self.net is None and self.sim.waves is None:
+                self.replay_file = 'replays/' + time.strftime('%Y%m%d-%H%M%S') + '.skyr'
+                replay.save(self.replay_file, self.recorder.replay(self.window.width, self.window.height, self.score))
+        self.game_over_labels[0].text = 'You win!' if self.enemy.health <= 0 else 'You lost'
+        self.game_over_labels[1].text = 'Your score ' + str(self.score - self.sim.score_timebonus - self.player.lives*250000) + f' timebonus {self.sim.score_timebonus} + lives {self.player.lives}*250000' if self.enemy.health <= 0 else f'Your Score: {self.score}'
+        self.game_over_labels[2].text = f'Final Score: {self.score}' if self.enemy.health <= 0 else ''
+
+        # defeated enemies leave the screen
+        for enemy in self.all_enemies:
+            enemy.sprite.visible = enemy in self.enemies
+
+
+    def create_enemy_sprite(self):
+        sprite = pyglet.sprite.Sprite(resources.enemy_image, batch = self.world_batch, group = layers.ENEMIES)
+        sprite.scale = 0.25
+        sprite.rotation = 180
+        return sprite
+
+
+    def hide_enemy(self, enemy):
+        enemy.sprite.visible = False
 
 
     def on_click(self, x, y, button, modifiers):
-        for button in self.current_batch['buttons']:
+        for button in self.current_buttons:
             button.on_click(x, y)
 
 
     def create_game_hud(self):
         self.level = 9999
-        self.score = 0
-        enemy_hp = pyglet.text.Label('', font_name='ethnocentric rg', x = 800, y = self.window.height - 15, anchor_y='top')
-        level = pyglet.text.Label('', font_name='ethnocentric rg', x = 800, y = self.window.height - 45, anchor_y='top')
-        player_hp = pyglet.text.Label('', font_name='ethnocentric rg', x = 800, y = self.window.height - 75, anchor_y='top')
-        score = pyglet.text.Label('', font_name='ethnocentric rg', x = 800, y = self.window.height - 105, anchor_y='top')
-        pause_button = UtilityFunctions.create_buttons(self.window.width - 15, 15, [('PAUSE', 16)])[0]
+        hud = HUD(800, self.window.height)
+        pause_button = UtilityFunctions.create_buttons(self.window.width - 15, 15, [('PAUSE', 16)], batch = self.playing_batch)[0]
         pause_button.label.anchor_y = 'bottom'
         pause_button.label.anchor_x = 'right'
-        return ([enemy_hp, level, player_hp, score], [pause_button])
-
-
-    def create_player_enemy(self):
-        self.player = Player(self.center_x*3/4, self.center_y//3, resources.player_image_sprite, 5)
-        self.enemy = Enemy(self.center_x*3/4, 7*self.center_y//4, resources.enemy_image_sprite, 50)
-        return (self.player, self.enemy)
+        return (hud, [pause_button])
 
 
     def create_game_over_screen(self):
-        win_text = pyglet.text.Label('', font_name='ethnocentric rg', font_size = 18, x = self.center_x, y = self.center_y, anchor_x='center', anchor_y='center')
-        bonus_text = pyglet.text.Label('', font_name='ethnocentric rg', font_size = 14, x = self.center_x, y = self.center_y - 50, anchor_x='center', anchor_y='center')
-        final_score = pyglet.text.Label('', font_name='ethnocentric rg', font_size = 24, x = self.center_x, y = self.center_y - 100, anchor_x='center', anchor_y='center')
-        exit_button = UtilityFunctions.create_buttons(self.window.width - 15, 15, [('EXIT', 18)])[0]
+        win_text = pyglet.text.Label('', font_name='ethnocentric rg', font_size = 18, x = self.center_x, y = self.center_y, anchor_x='center', anchor_y='center', batch = self.game_over_batch, group = layers.LABELS)
+        bonus_text = pyglet.text.Label('', font_name='ethnocentric rg', font_size = 14, x = self.center_x, y = self.center_y - 50, anchor_x='center', anchor_y='center', batch = self.game_over_batch, group = layers.LABELS)
+        final_score = pyglet.text.Label('', font_name='ethnocentric rg', font_size = 24, x = self.center_x, y = self.center_y - 100, anchor_x='center', anchor_y='center', batch = self.game_over_batch, group = layers.LABELS)
+        exit_button = UtilityFunctions.create_buttons(self.window.width - 15, 15, [('EXIT', 18)], batch = self.game_over_batch)[0]
         exit_button.label.anchor_y = 'bottom'
         exit_button.label.anchor_x = 'right'
         return ([win_text, bonus_text, final_score], [exit_button])
@@ -0,0 +1,82 @@
+import collections
+import logging
+import time
+
+
+# one way of doing less work, apply turns it on and restore turns it off again
+Degradation = collections.namedtuple('Degradation', ['name', 'apply', 'restore'])
+
+log = logging.getLogger(__name__)
+
+
+class Governor:
+    """ Keeps frames within a time budget by turning degradation steps on in order while over it, and off again once well under """
+    def __init__(self, budget, steps, frames = 60, over = 0.9, under = 0.6, cooldown = 1.0):
+        self.budget = budget            # seconds a whole frame, its ticks and its draw, may take
+        self.steps = steps
+        self.over = over
+        self.under = under
+        self.cooldown = cooldown        # seconds between two decisions, so every step gets to show its effect
+
+        self.tick_times = collections.deque(maxlen = frames)
+        self.draw_times = collections.deque(maxlen = frames)
+        self.level = 0                  # how many steps are on
+        self.since_decision = 0
+        self.behind = False
+
+        # every decision, as (seconds since start, 'apply' or 'restore', step name, mean frame ms)
+        self.decisions = []
+        self.started = time.perf_counter()
+
+
+    def tick(self, seconds, dropped = False):
+        """ Reports the time the ticks and sync of one frame took, dropped when the timestep had to give up game time """
+        self.tick_times.append(seconds)
+        self.behind = self.behind or dropped
+
+
+    def draw(self, seconds):
+        self.draw_times.append(seconds)
+
+
+    def frame_time(self):
+        """ Returns the mean seconds of the recent frames """
+        if not self.tick_times:
+            return 0
+        draw = sum(self.draw_times)/len(self.draw_times) if self.draw_times else 0
+        return sum(self.tick_times)/len(self.tick_times) + draw
+
+
+    def update(self, dt):
+        """ Decides once the cooldown is over whether to do less or more """
+        self.since_decision += dt
+        if self.since_decision < self.cooldown or len(self.tick_times) < self.tick_times.maxlen:
+            return
+
+        mean = self.frame_time()
+        if (self.behind or mean > self.over*self.budget) and self.level < len(self.steps):
+            step = self.steps[self.level]
+            step.apply()
+            self.level += 1
+            self.decide('apply', step, mean)
+        elif not self.behind and mean < self.under*self.budget and self.level > 0:
+            self.level -= 1
+            step = self.steps[self.level]
+            step.restore()
+            self.decide('restore', step, mean)
+        self.behind = False
+
+
+    def decide(self, action, step, mean):
+        self.since_decision = 0
+        self.tick_times.clear()
+        self.draw_times.clear()
+        decision = (time.perf_counter() - self.started, action, step.name, 1000*mean)
+        self.decisions.append(decision)
+        log.debug('%s %s, frames took %.2f ms of %.2f ms, level %d', action, step.name, 1000*mean, 1000*self.budget, self.level)
+
+
+    def reapply(self):
+        """ Applies the steps that are on again, for when what they act on was rebuilt """
+        for step in self.steps[:self.level]:
+            step.apply()
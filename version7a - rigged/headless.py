@@ -0,0 +1,298 @@
+import argparse
+import random
+import sys
+import time
+
+import pyglet
+
+# no window, GL context or audio device, this has to run before anything else imports pyglet.window
+pyglet.options['shadow_window'] = False
+pyglet.options['audio'] = ('silent',)
+
+from pyglet.window import key
+
+from simulation import Simulation
+from utils import NullSprite
+import replay
+import net
+from profiler import profiler, watch_simulation
+from autopilot import Autopilot
+from waves import WaveScript, WAVES
+from inputs import InputPipeline
+from simthread import SimulationThread, capture
+
+
+class ScriptedInput:
+    """ Takes the place of a KeyStateHandler, keys are held according to a script instead of a keyboard """
+    def __init__(self, script):
+        # script is a list of (tick, keys) pairs sorted by tick, the keys are held from that tick until the next entry
+        self.script = script
+        self.next_entry = 0
+        self.held = set()
+
+
+    def __getitem__(self, symbol):
+        return symbol in self.held
+
+
+    def advance(self, tick):
+        while self.next_entry < len(self.script) and self.script[self.next_entry][0] <= tick:
+            self.held = set(self.script[self.next_entry][1])
+            self.next_entry += 1
+
+
+def create_simulation(width = 1024, height = 768):
+    return Simulation(width, height, NullSprite(), NullSprite())
+
+
+def run(inputs, max_ticks = 100000, dt = 1/120, sim = None, recorder = None):
+    """ Plays a match as fast as possible until it is over or max_ticks is reached """
+    if sim is None:
+        sim = create_simulation()
+    while not sim.over and sim.tick_counter < max_ticks:
+        inputs.advance(sim.tick_counter + 1)
+        if recorder is not None:
+            recorder.record(inputs)
+        sim.step(dt, inputs)
+    sim.finish()
+    return sim
+
+
+# default script: keep firing and strafe under the enemy
+STRAFE = [(0, [key.Z, key.LEFT]), (60, [key.Z, key.RIGHT]), (180, [key.Z, key.LEFT]), (240, [])]
+
+
+def strafe_script(ticks):
+    return [(start + offset, keys) for start in range(0, ticks, 240) for offset, keys in STRAFE[:-1]]
+
+
+def play(filename):
+    """ Plays a recorded run back, returns the simulation and the score it should have ended with """
+    recorded = replay.load(filename)
+    sim = create_simulation(recorded.width, recorded.height)
+    return (run(replay.ReplayInput(recorded.runs), recorded.ticks, 1/recorded.rate, sim), recorded.score)
+
+
+class VirtualClock:
+    """ A clock that only moves when told to, for stamping made up key events """
+    def __init__(self):
+        self.now = 0
+
+
+    def __call__(self):
+        return self.now
+
+
+
+def tap_test(ticks, dt = 1/120, seed = 0):
+    """ Taps the fire and arrow keys at random moments between ticks through an InputPipeline, many of them shorter than a tick
+
+    Time is virtual: every tick starts dt after the last one and lasts as long as its step really took, so the latencies
+    are the ones a frame loop on this machine would see, with no display or keyboard. Returns the pipeline and the taps sent.
+    """
+    rng = random.Random(seed)
+    clock = VirtualClock()
+    inputs = InputPipeline(clock)
+    sim = create_simulation()
+
+    # (seconds, key, pressed) of every tap, one at a time
+    events = []
+    when = 0
+    while when < ticks*dt:
+        when += rng.uniform(0.005, 0.2)
+        length = rng.uniform(0.001, 0.05)
+        symbol = rng.choice([key.Z, key.LEFT, key.RIGHT, key.UP, key.DOWN])
+        events += [(when, symbol, True), (when + length, symbol, False)]
+        when += length
+
+    next_event = 0
+    for tick in range(1, ticks + 1):
+        while next_event < len(events) and events[next_event][0] <= tick*dt:
+            clock.now, symbol, pressed = events[next_event]
+            if pressed:
+                inputs.on_key_press(symbol, 0)
+            else:
+                inputs.on_key_release(symbol, 0)
+            next_event += 1
+        clock.now = tick*dt
+        inputs.advance(tick)
+        start = time.perf_counter()
+        sim.step(dt, inputs)
+        clock.now += time.perf_counter() - start
+        inputs.stepped()
+    return (inputs, sum(1 for when, symbol, pressed in events[:next_event] if pressed))
+
+
+class ScriptedMatch:
+    """ A match for a SimulationThread with no window, played by a script up to max_ticks """
+    def __init__(self, sim, inputs, max_ticks):
+        self.sim = sim
+        self.inputs = inputs
+        self.max_ticks = max_ticks
+
+
+    def tick(self, dt):
+        if self.sim.tick_counter < self.max_ticks:
+            self.inputs.advance(self.sim.tick_counter + 1)
+            self.sim.step(dt, self.inputs)
+
+
+    def render_state(self):
+        return capture(self.sim, self.sim.player, self.sim.over or self.sim.tick_counter >= self.max_ticks)
+
+
+
+def run_threaded(inputs, max_ticks, dt = 1/120, frame = 1/60):
+    """ Plays a match on a SimulationThread at real speed while this thread reads a state every frame the way drawing does
+
+    Returns the simulation, the thread, and how many frames were read and how many of them found no new tick.
+    """
+    sim = create_simulation()
+    thread = SimulationThread(ScriptedMatch(sim, inputs, max_ticks), round(1/dt))
+    thread.start()
+    frames = 0
+    repeated = 0
+    last_tick = None
+    next_frame = time.perf_counter()
+    while True:
+        state = thread.front
+        frames += 1
+        repeated += state.tick == last_tick
+        last_tick = state.tick
+        if state.over:
+            break
+        next_frame = pace(next_frame, frame)
+    thread.stop()
+    sim.finish()
+    return (sim, thread, frames, repeated)
+
+
+def pace(next_tick, dt):
+    """ Sleeps until next_tick, returns the time of the tick after it """
+    delay = next_tick - time.perf_counter()
+    if delay > 0:
+        time.sleep(delay)
+    return next_tick + dt
+
+
+def hold(sim, health):
+    """ Keeps the boss at health and every player alive, so a phase can be held as long as needed """
+    for enemy in sim.enemies:
+        enemy.health = health
+    for player in sim.players:
+        player.lives = 3
+
+
+def serve(port, max_ticks, dt = 1/120, health = None):
+    """ Hosts a co-op match at real speed, the second player is the one who joins """
+    host = net.NetHost(port)
+    sim = create_simulation()
+    sim.add_player(NullSprite(), host.remote)
+    host.attach(sim)
+    inputs = ScriptedInput(strafe_script(max_ticks))
+    while host.client is None:
+        host.poll()
+        time.sleep(0.01)
+
+    next_tick = time.perf_counter()
+    while not sim.over and sim.tick_counter < max_ticks:
+        host.poll()
+        inputs.advance(sim.tick_counter + 1)
+        if health is not None:
+            hold(sim, health)
+        sim.step(dt, inputs)
+        host.send()
+        next_tick = pace(next_tick, dt)
+    host.close()
+    return (sim, host.stats)
+
+
+def join(address, max_ticks, dt = 1/120):
+    """ Joins a co-op match at real speed, returns the mirrored simulation """
+    host, _, port = address.partition(':')
+    client = net.NetClient(host, int(port) if port else net.PORT)
+    sim = create_simulation()
+    sim.add_player(NullSprite())
+    client.attach(sim)
+    inputs = ScriptedInput(strafe_script(max_ticks))
+
+    next_tick = time.perf_counter()
+    for tick in range(1, max_ticks + 1):
+        inputs.advance(tick)
+        client.step(dt, inputs)
+        if client.over:
+            break
+        next_tick = pace(next_tick, dt)
+    client.close()
+    return (sim, client.stats)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Runs Sky Fight without a window')
+    parser.add_argument('--ticks', type = int, default = 20000, help = 'stop after this many ticks')
+    parser.add_argument('--record', help = 'save the scripted run as a replay')
+    parser.add_argument('--replay', help = 'play a replay back instead of the script')
+    parser.add_argument('--host', type = int, nargs = '?', const = net.PORT, help = 'host a co-op match on this port, at real speed')
+    parser.add_argument('--join', help = 'join a co-op match at host[:port], at real speed')
+    parser.add_argument('--autopilot', action = 'store_true', help = 'let the autopilot play instead of the script')
+    parser.add_argument('--waves', choices = list(WAVES), help = 'send in waves of enemies besides the boss')
+    parser.add_argument('--threaded', action = 'store_true', help = 'run the match on a simulation thread at real speed, read by this one at 60 fps')
+    parser.add_argument('--taps', action = 'store_true', help = 'tap keys at random moments between ticks and measure the input latency')
+    parser.add_argument('--trace', help = 'time the phases of every tick and write a Chrome trace here')
+    parser.add_argument('--hold-health', type = int, help = 'keep the boss at this health and the players alive, 300 holds phase 3')
+    args = parser.parse_args()
+    if args.waves and args.record:
+        parser.error('--waves cannot be recorded, replays do not keep the wave script')
+    if args.waves and (args.host or args.join):
+        parser.error('--waves cannot be played in co-op, only the enemies there at the start are sent to the client')
+
+    if args.host or args.join:
+        if args.host:
+            sim, stats = serve(args.host, args.ticks, health = args.hold_health)
+        else:
+            sim, stats = join(args.join, args.ticks)
+        print(f'ticks {stats.ticks}  score {sim.score}  bullets {len(sim.enemy_bullets)} + {len(sim.player_bullets)}')
+        print(f'{stats.summary()}  budget {net.BYTES_PER_TICK} bytes/tick')
+        sys.exit(0)
+
+    if args.taps:
+        inputs, sent = tap_test(args.ticks)
+        print(f'{sent} taps sent, {inputs.latency.count} reached a tick, {inputs.taps} of them let go before it, which polling would have lost')
+        print(f'input to effect: {inputs.latency.summary()}')
+        print('\n'.join(inputs.latency.lines()))
+        sys.exit(0)
+
+    if args.threaded:
+        sim, thread, frames, repeated = run_threaded(ScriptedInput(strafe_script(args.ticks)), args.ticks)
+        print(f'ticks {thread.ticks} on the simulation thread, busy {100*thread.busy/max(thread.ticks*thread.step, 1e-9):.0f}% of its time, {thread.dropped:.3f} s dropped')
+        print(f'frames {frames}, {repeated} of them found no new tick')
+        print(f'{"won" if sim.won else "lost" if sim.over else "unfinished"}  score {sim.score}  enemy hp {sim.enemy.health}  lives {sim.player.lives}')
+        sys.exit(0)
+
+    if args.trace:
+        watch_simulation(profiler)
+        profiler.enable()
+
+    start = time.perf_counter()
+    if args.replay:
+        sim, expected = play(args.replay)
+    else:
+        recorder = replay.Recorder() if args.record else None
+        sim = create_simulation()
+        if args.waves:
+            sim.waves = WaveScript(WAVES[args.waves])
+        inputs = Autopilot(sim, sim.player) if args.autopilot else ScriptedInput(strafe_script(args.ticks))
+        run(inputs, args.ticks, sim = sim, recorder = recorder)
+    elapsed = time.perf_counter() - start
+
+    print(f'ticks {sim.tick_counter}  {sim.tick_counter/elapsed:.0f} ticks/s')
+    print(f'{"won" if sim.won else "lost" if sim.over else "unfinished"}  score {sim.score}  enemy hp {sim.enemy.health}  lives {sim.player.lives}')
+    if args.autopilot:
+        print('autopilot decisions: mean {:.0f} us, slowest {:.0f} us'.format(*inputs.stats()))
+    if args.replay:
+        print('replay matches' if sim.score == expected else f'replay does not match, recorded score {expected}')
+    elif args.record:
+        replay.save(args.record, recorder.replay(sim.width, sim.height, sim.score))
+    if args.trace:
+        profiler.disable()
+        print(f'{profiler.dump(args.trace)} trace events written to {args.trace}')
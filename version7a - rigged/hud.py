@@ -0,0 +1,96 @@
+import time
+
+import pyglet
+
+import layers
+
+
+class NumberField:
+    """ A text prefix laid out once, followed by a number drawn from pre-rendered digit glyphs """
+    def __init__(self, prefix, x, y, font_name, font_size, glyphs, digits, dead_text = None):
+        self.prefix = prefix
+        self.dead_text = dead_text
+        self.label = pyglet.text.Label(prefix, font_name=font_name, font_size=font_size, x = x, y = y, anchor_y='top', group = layers.LABELS)
+        font = pyglet.font.load(font_name, font_size)
+        self.baseline = y - font.ascent
+        self.glyphs = glyphs
+        self.value = None
+
+        # one sprite per digit, shown holds the character each sprite draws right now
+        self.sprites = [pyglet.sprite.Sprite(glyphs['0'], group = layers.LABELS) for _ in range(digits)]
+        self.shown = [None]*digits
+        for sprite in self.sprites:
+            sprite.visible = False
+
+
+    def set_batch(self, batch):
+        self.label.batch = batch
+        for sprite in self.sprites:
+            sprite.batch = batch
+
+
+    def set(self, value):
+        """ Shows a new value, returns how many sprites had to change """
+        if value == self.value:
+            return 0
+        self.value = value
+
+        # a negative value may swap the whole field for a message, like a dead player
+        prefix = self.dead_text if self.dead_text is not None and value < 0 else self.prefix
+        if self.label.text != prefix:
+            self.label.text = prefix
+        text = str(value) if prefix == self.prefix else ''
+
+        changed = 0
+        pen = self.label.x + self.label.content_width
+        for i, sprite in enumerate(self.sprites):
+            if i < len(text):
+                glyph = self.glyphs[text[i]]
+                x = pen + glyph.vertices[0]
+                if self.shown[i] != text[i]:
+                    sprite.image = glyph
+                    sprite.update(x = x, y = self.baseline + glyph.vertices[1])
+                    sprite.visible = True
+                    self.shown[i] = text[i]
+                    changed += 1
+                elif sprite.x != x:
+                    sprite.x = x
+                    changed += 1
+                pen += glyph.advance
+            elif self.shown[i] is not None:
+                sprite.visible = False
+                self.shown[i] = None
+                changed += 1
+        return changed
+
+
+
+class HUD:
+    """ The in-game heads up display, a field is only touched when its value changes """
+    def __init__(self, x, top, font_name = 'ethnocentric rg', font_size = 12):
+        font = pyglet.font.load(font_name, font_size)
+        glyphs = dict(zip('0123456789-', font.get_glyphs('0123456789-')))
+
+        self.fields = {
+            'enemy_hp': NumberField('ENEMY HP: ', x, top - 15, font_name, font_size, glyphs, 5),
+            'level': NumberField('LEVEL: ', x, top - 45, font_name, font_size, glyphs, 5),
+            'lives': NumberField('PLAYER LIVES:', x, top - 75, font_name, font_size, glyphs, 3, 'player: dead'),
+            'score': NumberField('SCORE: ', x, top - 105, font_name, font_size, glyphs, 12),
+        }
+
+        # what the hud costs: sprites changed and seconds spent in the last update
+        self.changes = 0
+        self.cost = 0
+
+
+    def set_batch(self, batch):
+        for field in self.fields.values():
+            field.set_batch(batch)
+
+
+    def update(self, **values):
+        start = time.perf_counter()
+        self.changes = 0
+        for name, value in values.items():
+            self.changes += self.fields[name].set(value)
+        self.cost = time.perf_counter() - start
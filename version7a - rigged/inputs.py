@@ -0,0 +1,127 @@
+import bisect
+import collections
+import threading
+import time
+
+
+# upper edges of the latency buckets in ms, a last bucket takes everything slower
+EDGES_MS = [1, 2, 4, 6, 8, 10, 12, 16, 20, 25, 33, 50, 75, 100]
+
+
+class LatencyHistogram:
+    """ Counts latencies into fixed buckets, cheap enough to add to every tick, read back as percentiles """
+    def __init__(self, edges = EDGES_MS):
+        self.edges = list(edges)
+        self.counts = [0]*(len(self.edges) + 1)
+        self.count = 0
+        self.total = 0
+        self.slowest = 0
+
+
+    def add(self, seconds):
+        ms = 1000*seconds
+        self.counts[bisect.bisect_left(self.edges, ms)] += 1
+        self.count += 1
+        self.total += ms
+        self.slowest = max(self.slowest, ms)
+
+
+    def mean(self):
+        return self.total/self.count if self.count else 0
+
+
+    def percentile(self, p):
+        """ Returns the upper edge in ms of the bucket the p-th percentile falls in, the slowest latency for the last one """
+        rank = self.count*p/100
+        seen = 0
+        for edge, count in zip(self.edges + [self.slowest], self.counts):
+            seen += count
+            if count and seen >= rank:
+                return min(edge, self.slowest)
+        return 0
+
+
+    def summary(self):
+        return (f'{self.count} presses  mean {self.mean():.1f} ms  p50 <= {self.percentile(50):.0f} ms  '
+                f'p99 <= {self.percentile(99):.0f} ms  slowest {self.slowest:.1f} ms')
+
+
+    def lines(self, width = 40):
+        """ The buckets as text bars, empty ones left out """
+        most = max(self.counts) or 1
+        lines = []
+        low = 0
+        for edge, count in zip(self.edges + [float('inf')], self.counts):
+            if count:
+                label = f'{low:g}-{edge:g} ms' if edge != float('inf') else f'> {low:g} ms'
+                lines.append(f'{label:>12} {count:7} ' + '#'*max(1, round(width*count/most)))
+            low = edge
+        return lines
+
+
+
+class InputPipeline:
+    """ Takes the place of a KeyStateHandler, key events are timestamped as they come and handed to the next tick in order """
+    def __init__(self, clock = time.perf_counter):
+        # events are stamped with clock, a test can drive it by hand and send events through on_key_press and on_key_release
+        self.clock = clock
+        self.events = collections.deque()       # (seconds, symbol, pressed) since the last tick
+        self.down = set()                       # keys down after the last event taken in
+        self.lock = threading.Lock()            # guards down, the window releases keys while a simulation thread takes events in
+        self.held = set()                       # keys the current tick sees
+
+        # presses the current tick took in, and how long every press took from the keyboard to the end of its tick
+        self.taken = []
+        self.latency = LatencyHistogram()
+        self.taps = 0               # presses let go before their tick came, polling the keyboard would have missed them
+
+
+    def __getitem__(self, symbol):
+        return symbol in self.held
+
+
+    def on_key_press(self, symbol, modifiers):
+        self.events.append((self.clock(), symbol, True))
+
+
+    def on_key_release(self, symbol, modifiers):
+        self.events.append((self.clock(), symbol, False))
+
+
+    def on_deactivate(self):
+        # the releases of the keys down when the window lost focus never arrive
+        with self.lock:
+            down = list(self.down)
+        for symbol in down:
+            self.on_key_release(symbol, 0)
+
+
+    def advance(self, tick = None):
+        """ Takes in the events since the last tick, a key pressed and let go in between is still held for this one tick """
+        pressed = set()
+        with self.lock:
+            while self.events:
+                stamp, symbol, down = self.events.popleft()
+                if not down:
+                    self.down.discard(symbol)
+                elif symbol not in self.down:
+                    self.down.add(symbol)
+                    pressed.add(symbol)
+                    self.taken.append(stamp)
+            self.taps += len(pressed - self.down)
+            self.held = self.down | pressed
+
+
+    def stepped(self):
+        """ Call once the tick that saw the keys is done, it is where the presses took effect """
+        if self.taken:
+            now = self.clock()
+            for stamp in self.taken:
+                self.latency.add(now - stamp)
+            self.taken = []
+
+
+    def skip(self):
+        """ Takes in the events while no match runs, they are not counted """
+        self.advance()
+        self.taken = []
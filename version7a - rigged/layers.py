@@ -0,0 +1,23 @@
+import pyglet
+
+
+# draw order shared by every screen, each screen draws all of its sprites and labels from one batch
+BACKGROUND = pyglet.graphics.OrderedGroup(0)
+ENEMIES = pyglet.graphics.OrderedGroup(1)
+PLAYER = pyglet.graphics.OrderedGroup(2)
+PLAYER_BULLETS = pyglet.graphics.OrderedGroup(3)
+ENEMY_BULLETS = pyglet.graphics.OrderedGroup(4)
+BUTTONS = pyglet.graphics.OrderedGroup(5)
+LABELS = pyglet.graphics.OrderedGroup(6)
+
+
+def draw_calls(batch):
+    """ Returns how many draw calls and texture binds one draw of the batch takes """
+    calls = 0
+    textures = 0
+    for group, domains in batch.group_map.items():
+        used = sum(1 for domain in domains.values() if domain.allocator.starts)
+        calls += used
+        if used and hasattr(group, 'texture'):
+            textures += 1
+    return (calls, textures)
@@ -0,0 +1,574 @@
+import collections
+import socket
+import time
+
+import numpy as np
+
+from replay import BITS, pack
+
+
+PORT = 50417
+
+# the host sends a snapshot every SEND_EVERY ticks, BYTES_PER_TICK builds up a credit that packets spend,
+# so a burst can borrow from the quiet ticks around it but never from more than BURST_TICKS of them
+BYTES_PER_TICK = 256
+BURST_TICKS = 8
+SEND_EVERY = 2
+MAX_PACKET = 1200
+
+# ticks of bullet changes kept for a client that has not caught up, older ones need a full resync
+HISTORY = 240
+
+# the client draws this many ticks behind the newest snapshot, so it has two to interpolate between
+INTERPOLATION_DELAY = 2*SEND_EVERY
+
+# packet types
+INPUT = 1
+SNAPSHOT = 2
+
+# field widths and scales of the quantized values
+POSITION_BITS = 15          # 1/8 px, from -1024 px
+VELOCITY_BITS = 15          # 1/4 px/s, signed
+ROTATION_BITS = 9           # whole degrees
+SCALE_BITS = 7              # 1/50
+
+
+class BitWriter:
+    """ Packs values of any bit width one after the other """
+    def __init__(self):
+        self.value = 0
+        self.bits = 0
+
+
+    def write(self, value, bits):
+        self.value |= (int(value) & ((1 << bits) - 1)) << self.bits
+        self.bits += bits
+
+
+    def varint(self, value):
+        """ Small numbers in few bits: three bits a nibble, the fourth says whether more follow """
+        value = int(value)
+        while value >= 8:
+            self.write((value & 7) | 8, 4)
+            value >>= 3
+        self.write(value, 4)
+
+
+    def signed_varint(self, value):
+        value = int(value)
+        self.varint(2*value if value >= 0 else -2*value - 1)
+
+
+    def append(self, other):
+        self.write(other.value, other.bits)
+
+
+    def size(self):
+        return (self.bits + 7)//8
+
+
+    def to_bytes(self):
+        return self.value.to_bytes(self.size(), 'little')
+
+
+
+class BitReader:
+    def __init__(self, data):
+        self.value = int.from_bytes(data, 'little')
+        self.bits = 0
+
+
+    def read(self, bits):
+        value = (self.value >> self.bits) & ((1 << bits) - 1)
+        self.bits += bits
+        return value
+
+
+    def signed(self, bits):
+        value = self.read(bits)
+        return value - (1 << bits) if value >= 1 << (bits - 1) else value
+
+
+    def varint(self):
+        value = 0
+        shift = 0
+        while True:
+            nibble = self.read(4)
+            value |= (nibble & 7) << shift
+            shift += 3
+            if nibble < 8:
+                return value
+
+
+    def signed_varint(self):
+        value = self.varint()
+        return value//2 if value%2 == 0 else -(value + 1)//2
+
+
+
+def quantize_position(v):
+    return np.clip(np.round((np.asarray(v) + 1024)*8), 0, (1 << POSITION_BITS) - 1).astype(np.int64)
+
+
+def position(q):
+    return q/8 - 1024
+
+
+def quantize_velocity(v):
+    limit = (1 << (VELOCITY_BITS - 1)) - 1
+    return np.clip(np.round(np.asarray(v)*4), -limit, limit).astype(np.int64)
+
+
+def heading(velx, vely):
+    """ Whole degrees clockwise from +y, what the rotation of a bullet usually is, from quantized velocities """
+    return np.round(np.degrees(np.arctan2(velx, vely))).astype(np.int64)%360
+
+
+def write_objects(writer, sim, enemies):
+    writer.write(len(sim.players), 2)
+    for player in sim.players:
+        writer.write(quantize_position(player.x), POSITION_BITS)
+        writer.write(quantize_position(player.y), POSITION_BITS)
+        writer.write(player.lives, 5)
+        writer.write(player.invincibility, 11)
+    writer.write(len(enemies), 4)
+    for enemy in enemies:
+        writer.write(quantize_position(enemy.x), POSITION_BITS)
+        writer.write(quantize_position(enemy.y), POSITION_BITS)
+        writer.write(max(enemy.health, 0), 11)
+
+
+def read_objects(reader):
+    players = [(position(reader.read(POSITION_BITS)), position(reader.read(POSITION_BITS)), reader.signed(5), reader.read(11)) for _ in range(reader.read(2))]
+    enemies = [(position(reader.read(POSITION_BITS)), position(reader.read(POSITION_BITS)), reader.read(11)) for _ in range(reader.read(4))]
+    return (players, enemies)
+
+
+
+class Changes:
+    """ The bullets one store gained and lost on one tick, the new ones already quantized """
+    def __init__(self, tick, store_index, store, new, removed):
+        self.tick = tick
+        self.store_index = store_index
+        self.ids = store.ids[new]
+        self.kind = store.kind[new].astype(np.int64)
+        self.x = quantize_position(store.x[new])
+        self.y = quantize_position(store.y[new])
+        self.velx = quantize_velocity(store.velx[new])
+        self.vely = quantize_velocity(store.vely[new])
+        self.rotation = np.round(store.rotation[new]).astype(np.int64)%360
+        self.scale = np.clip(np.round(store.scale[new]*50), 0, (1 << SCALE_BITS) - 1).astype(np.int64)
+        self.removed = removed
+
+        # a bullet mostly points along its velocity or right against it, then the rotation need not be sent
+        ahead = heading(self.velx, self.vely)
+        self.rotation_mode = np.where(self.rotation == ahead, 0, np.where(self.rotation == (ahead + 180)%360, 1, 2))
+
+
+    def write(self, writer, baseline):
+        writer.varint(self.tick - baseline)
+        writer.write(self.store_index, 1)
+        writer.varint(len(self.ids))
+
+        # bullets of one volley share most fields, each is written against the one before it
+        previous = (-1, -1, 0, 0, -1)           # id, kind, x, y, scale
+        for i in range(len(self.ids)):
+            writer.varint(self.ids[i] - previous[0] - 1)
+            writer.write(self.kind[i] != previous[1], 1)
+            if self.kind[i] != previous[1]:
+                writer.write(self.kind[i], 2)
+            writer.write(self.scale[i] != previous[4], 1)
+            if self.scale[i] != previous[4]:
+                writer.write(self.scale[i], SCALE_BITS)
+            writer.signed_varint(self.x[i] - previous[2])
+            writer.signed_varint(self.y[i] - previous[3])
+            writer.write(self.velx[i], VELOCITY_BITS)
+            writer.write(self.vely[i], VELOCITY_BITS)
+            writer.write(self.rotation_mode[i], 2)
+            if self.rotation_mode[i] == 2:
+                writer.write(self.rotation[i], ROTATION_BITS)
+            previous = (self.ids[i], self.kind[i], self.x[i], self.y[i], self.scale[i])
+        writer.varint(len(self.removed))
+        previous = -1
+        for removed_id in self.removed:
+            writer.varint(removed_id - previous - 1)
+            previous = removed_id
+
+
+def read_changes(reader, baseline):
+    """ Returns (tick, store_index, spawns, removed), spawns as a tuple of arrays """
+    tick = baseline + reader.varint()
+    store_index = reader.read(1)
+    rows = []
+    spawn_id, kind, x, y, scale = (-1, -1, 0, 0, -1)
+    for _ in range(reader.varint()):
+        spawn_id += reader.varint() + 1
+        if reader.read(1):
+            kind = reader.read(2)
+        if reader.read(1):
+            scale = reader.read(SCALE_BITS)
+        x += reader.signed_varint()
+        y += reader.signed_varint()
+        velx = reader.signed(VELOCITY_BITS)
+        vely = reader.signed(VELOCITY_BITS)
+        mode = reader.read(2)
+        rotation = reader.read(ROTATION_BITS) if mode == 2 else (heading(velx, vely) + 180*mode)%360
+        rows.append((spawn_id, kind, position(x), position(y), velx/4, vely/4, rotation, scale/50))
+    removed = []
+    previous = -1
+    for _ in range(reader.varint()):
+        previous += reader.varint() + 1
+        removed.append(previous)
+    spawns = tuple(np.array(column) for column in zip(*rows)) if rows else None
+    return (tick, store_index, spawns, np.array(removed, dtype=np.int64))
+
+
+
+class NetStats:
+    """ Bandwidth and latency of one end of the connection """
+    def __init__(self):
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.packets_sent = 0
+        self.packets_received = 0
+        self.largest_packet = 0
+        self.over_budget = 0        # snapshots that could not be kept under the budget
+        self.lost = 0               # snapshots that never arrived
+        self.rtt = None             # seconds, smoothed
+        self.ticks = 0
+
+
+    def sent(self, size):
+        self.bytes_sent += size
+        self.packets_sent += 1
+        self.largest_packet = max(self.largest_packet, size)
+
+
+    def received(self, size):
+        self.bytes_received += size
+        self.packets_received += 1
+
+
+    def measured_rtt(self, rtt):
+        self.rtt = rtt if self.rtt is None else 0.9*self.rtt + 0.1*rtt
+
+
+    def bytes_per_tick(self):
+        return max(self.bytes_sent, self.bytes_received)/max(self.ticks, 1)
+
+
+    def summary(self):
+        rtt = f'{1000*self.rtt:.1f} ms' if self.rtt is not None else '-'
+        return (f'{self.bytes_per_tick():.1f} bytes/tick  largest packet {self.largest_packet}  over budget {self.over_budget}  '
+                f'lost {self.lost}  rtt {rtt}')
+
+
+
+class RemoteInput:
+    """ Takes the place of a KeyStateHandler, the keys are the last ones the client sent """
+    def __init__(self):
+        self.mask = 0
+
+
+    def __getitem__(self, symbol):
+        return bool(self.mask & BITS.get(symbol, 0))
+
+
+
+class NetHost:
+    """ Runs next to the authoritative simulation, takes the client's keys and sends it snapshots """
+    authoritative = True
+
+    def __init__(self, port = PORT):
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.socket.bind(('', port))
+        self.socket.setblocking(False)
+        self.client = None
+        self.remote = RemoteInput()
+        self.stats = NetStats()
+        self.match = 0
+        self.sim = None
+
+
+    def attach(self, sim):
+        """ Starts a new match on sim, the client is resynced """
+        self.sim = sim
+        self.match = (self.match + 1)%256
+        # only the enemies of the start are sent, which is why co-op matches have no waves
+        self.enemies = list(sim.enemies)
+        self.stores = [sim.player_bullets, sim.enemy_bullets]
+        self.live = [store.ids[:store.count].copy() for store in self.stores]
+        self.seen = [store.next_id for store in self.stores]
+        self.history = collections.deque()
+        self.horizon = sim.tick_counter     # changes up to here are no longer in history
+        self.credit = 0
+        self.input_seq = -1
+        self.client_match = None
+        self.client_ack = 0
+
+
+    def poll(self):
+        while True:
+            try:
+                data, address = self.socket.recvfrom(65535)
+            except (BlockingIOError, ConnectionResetError):
+                return
+            self.stats.received(len(data))
+            reader = BitReader(data)
+            if reader.read(8) != INPUT:
+                continue
+            seq = reader.read(32)
+            if seq <= self.input_seq and address == self.client:
+                continue            # late or repeated
+            self.client = address
+            self.input_seq = seq
+            self.client_match = reader.read(8)
+            self.client_ack = reader.read(32)
+            self.remote.mask = reader.read(len(BITS))
+
+
+    def record(self):
+        """ Notes what every bullet store gained and lost on the tick just stepped """
+        tick = self.sim.tick_counter
+        for i, store in enumerate(self.stores):
+            ids = store.ids[:store.count]
+            new = np.flatnonzero(ids >= self.seen[i])
+            removed = np.setdiff1d(self.live[i], ids, assume_unique = True)
+            if len(new) or len(removed):
+                self.history.append(Changes(tick, i, store, new, removed))
+            self.live[i] = ids.copy()
+            self.seen[i] = store.next_id
+
+        # what the client has and what it is too late for is let go
+        while self.history and (self.history[0].tick <= self.client_ack or self.history[0].tick <= tick - HISTORY):
+            self.horizon = max(self.horizon, self.history.popleft().tick)
+        self.credit = min(self.credit + BYTES_PER_TICK, BYTES_PER_TICK*BURST_TICKS)
+        self.stats.ticks += 1
+
+
+    def send(self):
+        """ Records the tick and sends a snapshot every SEND_EVERY ticks """
+        self.record()
+        if self.client is None or self.sim.tick_counter%SEND_EVERY != 0:
+            return
+        packet = self.snapshot()
+        self.socket.sendto(packet, self.client)
+        self.credit -= len(packet)
+        self.stats.sent(len(packet))
+
+
+    def snapshot(self):
+        sim = self.sim
+        tick = sim.tick_counter
+        budget = min(self.credit, MAX_PACKET)
+
+        # a client on another match or too far behind gets every live bullet again
+        reset = self.client_match != self.match or self.client_ack < self.horizon
+        if reset:
+            changes = [Changes(tick, i, store, np.arange(store.count), []) for i, store in enumerate(self.stores)]
+            baseline = tick
+        else:
+            changes = list(self.history)
+            baseline = self.client_ack
+
+        writer = BitWriter()
+        writer.write(SNAPSHOT, 8)
+        writer.write(self.match, 8)
+        writer.write(tick, 32)
+        writer.write(self.input_seq, 32)
+        writer.write(baseline, 32)
+        writer.write(reset, 1)
+        writer.write(sim.over, 1)
+        writer.write(sim.score, 32)
+        writer.write(sim.score_timebonus, 32)
+        write_objects(writer, sim, self.enemies)
+
+        # changes go in a whole tick at a time, as many ticks as the budget allows
+        groups = BitWriter()
+        count = 0
+        events_tick = tick
+        i = 0
+        while i < len(changes):
+            j = i
+            group = BitWriter()
+            while j < len(changes) and changes[j].tick == changes[i].tick:
+                changes[j].write(group, baseline)
+                j += 1
+            if count > 0 and writer.bits + 32 + 12 + groups.bits + group.bits > 8*budget:
+                events_tick = changes[i].tick - 1
+                break
+            groups.append(group)
+            count += j - i
+            i = j
+        writer.write(events_tick, 32)
+        writer.varint(count)
+        writer.append(groups)
+
+        if writer.size() > budget:
+            self.stats.over_budget += 1
+        return writer.to_bytes()
+
+
+    def close(self):
+        self.socket.close()
+
+
+
+class NetClient:
+    """ Sends the local keys to the host and shows its snapshots, the client runs no game logic of its own """
+    authoritative = False
+    remote = None               # the keys go to the host, none come in
+
+    def __init__(self, address, port = PORT):
+        self.address = (address, port)
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.socket.setblocking(False)
+        self.stats = NetStats()
+        self.match = None
+        self.seq = 0
+        self.sent_times = collections.OrderedDict()
+        self.sim = None
+
+
+    def attach(self, sim):
+        self.sim = sim
+        self.enemies = list(sim.enemies)
+        self.stores = [sim.player_bullets, sim.enemy_bullets]
+        self.reset()
+
+
+    def reset(self):
+        for store in self.stores:
+            store.clear()
+        self.snapshots = collections.deque(maxlen = 16)     # (tick, over, score, timebonus, players, enemies)
+        self.pending = collections.deque()
+        self.applied = 0            # bullet changes are known up to this tick
+        self.latest = -1
+        self.tick = None
+        self.over = False
+
+
+    def send_input(self, key_handler):
+        self.seq += 1
+        writer = BitWriter()
+        writer.write(INPUT, 8)
+        writer.write(self.seq, 32)
+        writer.write(self.match if self.match is not None else 255, 8)
+        writer.write(self.applied, 32)
+        writer.write(pack(key_handler), len(BITS))
+        packet = writer.to_bytes()
+        self.socket.sendto(packet, self.address)
+        self.stats.sent(len(packet))
+        self.sent_times[self.seq] = time.perf_counter()
+        while len(self.sent_times) > 512:
+            self.sent_times.popitem(last = False)
+
+
+    def poll(self):
+        while True:
+            try:
+                data, address = self.socket.recvfrom(65535)
+            except (BlockingIOError, ConnectionResetError):
+                return
+            self.stats.received(len(data))
+            self.receive(BitReader(data))
+
+
+    def receive(self, reader):
+        if reader.read(8) != SNAPSHOT:
+            return
+        match = reader.read(8)
+        tick = reader.read(32)
+        input_seq = reader.read(32)
+        baseline = reader.read(32)
+        reset = reader.read(1)
+        over = reader.read(1)
+        score = reader.signed(32)
+        timebonus = reader.signed(32)
+        players, enemies = read_objects(reader)
+        events_tick = reader.read(32)
+
+        if input_seq in self.sent_times:
+            self.stats.measured_rtt(time.perf_counter() - self.sent_times[input_seq])
+        if reset:
+            self.match = match
+            self.reset()
+        elif match != self.match or baseline > self.applied:
+            return                  # changes this snapshot builds on never arrived, wait for a newer one
+
+        for _ in range(reader.varint()):
+            changes = read_changes(reader, baseline)
+            if changes[0] > self.applied:
+                self.pending.append(changes)
+        self.applied = max(self.applied, events_tick)
+
+        if tick > self.latest:
+            if self.latest >= 0:
+                self.stats.lost += max((tick - self.latest)//SEND_EVERY - 1, 0)
+            self.latest = tick
+            self.snapshots.append((tick, over, score, timebonus, players, enemies))
+
+
+    def step(self, dt, key_handler):
+        """ Sends the keys of this tick and moves everything one tick closer to the host """
+        self.send_input(key_handler)
+        self.poll()
+        self.stats.ticks += 1
+        if not self.snapshots:
+            return
+
+        # drift back towards the delay behind the host, jump if too far off
+        target = self.latest - INTERPOLATION_DELAY
+        if self.tick is None or abs(target - self.tick) > 60:
+            self.tick = target
+            steps = 1
+        else:
+            steps = 1 + (target > self.tick + 2) - (target < self.tick - 2)
+        for _ in range(steps):
+            self.tick += 1
+            for store in self.stores:
+                store.update(dt, self.sim.bounds)
+            while self.pending and self.pending[0][0] <= self.tick:
+                self.apply(*self.pending.popleft(), dt)
+        self.interpolate()
+
+
+    def apply(self, tick, store_index, spawns, removed, dt):
+        store = self.stores[store_index]
+        if len(removed):
+            store.remove(np.flatnonzero(np.isin(store.ids[:store.count], removed)))
+        if spawns is not None:
+            ids, kind, x, y, velx, vely, rotation, scale = spawns
+            late = (self.tick - tick)*dt
+            store.append(x + velx*late, y + vely*late, velx, vely, rotation, scale, 0, kind, ids)
+
+
+    def interpolate(self):
+        """ Places the players and enemies between the two snapshots around the client's tick """
+        before = self.snapshots[0]
+        after = self.snapshots[-1]
+        for snapshot in self.snapshots:
+            if snapshot[0] <= self.tick:
+                before = snapshot
+            else:
+                after = snapshot
+                break
+        span = after[0] - before[0]
+        f = min(max((self.tick - before[0])/span, 0), 1) if span > 0 else 1
+
+        sim = self.sim
+        tick, self.over, sim.score, sim.score_timebonus, players, enemies = after
+        for player, (x0, y0, _, _), (x1, y1, lives, invincibility) in zip(sim.players, before[4], players):
+            player.prev_x, player.prev_y = (player.x, player.y)
+            player.x, player.y = (x0 + (x1 - x0)*f, y0 + (y1 - y0)*f)
+            player.lives, player.invincibility = (lives, invincibility)
+        for enemy, (x0, y0, _), (x1, y1, health) in zip(self.enemies, before[5], enemies):
+            enemy.prev_x, enemy.prev_y = (enemy.x, enemy.y)
+            enemy.x, enemy.y = (x0 + (x1 - x0)*f, y0 + (y1 - y0)*f)
+            enemy.health = health
+            if health <= 0 and enemy in sim.enemies:
+                sim.enemies.remove(enemy)
+                enemy.active = False
+
+    def close(self):
+        self.socket.close()
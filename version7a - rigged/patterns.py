@@ -0,0 +1,177 @@
+import copy
+import json
+import math
+
+import numpy as np
+
+from bullets import CIRCLE, CIRCLE_WHITE, OVAL
+from spawntables import SpawnTable, PatternTables
+
+
+KINDS = {'circle': CIRCLE, 'circle_white': CIRCLE_WHITE, 'oval': OVAL}
+
+
+# a boss as data: patterns by name, and the phases that turn them on as its health drops
+#
+#   every       ticks between volleys
+#   aim         'player', or a fixed direction in degrees clockwise from straight up
+#   volleys     groups of bullets fired together, each one every offset x every speed x every angle, in that order
+#     angles    a list of degrees, {'spread': n, 'step': degrees} centered on the aim, or {'ring': n} all around
+#     speeds    px/s, a negative speed fires backwards
+#     offsets   px to the side of the shooter, [0] if left out
+#     spin      degrees the angles turn every tick
+#     scale, radius, kind
+#
+# a phase starts once the health is at or below its hp, 'start' starts it with the first hit the boss takes
+SKY_FIGHT = {
+    'patterns': {
+        'pattern1': {'every': 15, 'volleys': [
+            {'angles': {'spread': 7, 'step': 30}, 'speeds': [-250, 250], 'spin': -1/1.5, 'scale': 1, 'radius': 6, 'kind': 'circle'},
+        ]},
+        'pattern2': {'every': 20, 'volleys': [
+            {'angles': {'spread': 13, 'step': 15}, 'speeds': [-300, 300], 'spin': -1/2, 'scale': 1.2, 'radius': 7, 'kind': 'circle_white'},
+            {'angles': {'spread': 13, 'step': 15}, 'speeds': [-325, 325], 'spin': 1/2, 'scale': 1.2, 'radius': 8, 'kind': 'oval'},
+        ]},
+        'pattern3': {'every': 10, 'volleys': [
+            {'offsets': [-200, 200], 'angles': [-90, -60, -30, 30, 60, 90], 'speeds': [-500, 500], 'scale': 1.5, 'radius': 10, 'kind': 'oval'},
+        ]},
+    },
+    'phases': [
+        {'hp': 'start', 'patterns': ['pattern1']},
+        {'hp': 750, 'patterns': ['pattern1', 'pattern2']},
+        {'hp': 350, 'patterns': ['pattern1', 'pattern2', 'pattern3']},
+    ],
+}
+
+# a small enemy of the waves, firing a short aimed spread for as long as it lives
+DRONE = {
+    'patterns': {
+        'spread': {'every': 90, 'volleys': [
+            {'angles': {'spread': 3, 'step': 15}, 'speeds': [-220], 'scale': 1, 'radius': 7, 'kind': 'circle_white'},
+        ]},
+    },
+    'phases': [
+        {'hp': 1000000, 'patterns': ['spread']},
+    ],
+}
+
+
+def angles(shape):
+    if isinstance(shape, dict) and 'spread' in shape:
+        return (np.arange(shape['spread']) - (shape['spread'] - 1)/2)*shape['step']
+    if isinstance(shape, dict) and 'ring' in shape:
+        return np.arange(shape['ring'])*360/shape['ring']
+    return np.array(shape, dtype=float)
+
+
+def spin_cycle(spins):
+    """ Returns after how many ticks every angle is back where it started, None if they never line up """
+    cycle = 1
+    for spin in set(spins):
+        if spin == 0:
+            continue
+        ticks = 360/abs(spin)
+        if abs(ticks - round(ticks)) > 1e-6:
+            return None
+        cycle = cycle*round(ticks)//math.gcd(cycle, round(ticks))
+    return cycle
+
+
+
+class Emitter:
+    """ One pattern compiled into flat arrays, a volley is one SpawnTable written into the store in one go """
+    def __init__(self, definition):
+        self.every = definition['every']
+        self.aim = definition.get('aim', 'player')
+
+        columns = {name: [] for name in ['offset', 'speed', 'angle', 'spin', 'scale', 'radius', 'kind']}
+        for volley in definition['volleys']:
+            offset, speed, angle = np.meshgrid(volley.get('offsets', [0]), volley['speeds'], angles(volley['angles']), indexing = 'ij')
+            size = angle.size
+            columns['offset'].append(offset.ravel())
+            columns['speed'].append(speed.ravel())
+            columns['angle'].append(angle.ravel())
+            columns['spin'].append(np.full(size, volley.get('spin', 0), dtype=float))
+            columns['scale'].append(np.full(size, volley.get('scale', 1), dtype=float))
+            columns['radius'].append(np.full(size, volley['radius'], dtype=float))
+            columns['kind'].append(np.full(size, KINDS[volley['kind']]))
+        for name, parts in columns.items():
+            setattr(self, name, np.concatenate(parts))
+
+        # the tables of a spinning pattern repeat after a cycle of ticks, one that never repeats is looked up by tick
+        cycle = spin_cycle(self.spin)
+        self.tables = PatternTables(self.volley, cycle or 2**62)
+
+
+    def __len__(self):
+        return len(self.kind)
+
+
+    def volley(self, tick):
+        return SpawnTable(self.offset, self.speed, self.angle + self.spin*tick, self.scale, self.radius, self.kind)
+
+
+    def fire(self, shooter, target, tick, bullets):
+        """ Fires a volley if this is one of its ticks, returns how many bullets were fired """
+        if tick%self.every != 0:
+            return 0
+        if self.aim == 'player':
+            return self.tables.fire(shooter, target, tick, bullets)
+        radians = math.radians(self.aim)
+        return self.tables.table(tick).fire(shooter.x, shooter.y, math.sin(radians), math.cos(radians), self.aim, bullets)
+
+
+    def fire_many(self, x, y, target, tick, bullets):
+        """ Fires a volley from every shooter at x, y if this is one of its ticks, returns how many bullets were fired """
+        if tick%self.every != 0:
+            return 0
+        table = self.tables.table(tick)
+        if self.aim == 'player':
+            slope = (target.x - x)/(target.y - y)
+            cos_aim = 1/np.sqrt(1 + slope*slope)
+            return table.fire_many(x, y, slope*cos_aim, cos_aim, np.degrees(np.arctan(slope)), bullets)
+        radians = math.radians(self.aim)
+        aim = np.full(len(x), float(self.aim))
+        return table.fire_many(x, y, np.full(len(x), math.sin(radians)), np.full(len(x), math.cos(radians)), aim, bullets)
+
+
+
+class Boss:
+    """ A boss definition compiled once, the emitters of every phase ready to fire """
+    def __init__(self, definition):
+        self.definition = definition
+        self.patterns = {name: Emitter(pattern) for name, pattern in definition['patterns'].items()}
+        self.phases = sorted([(phase['hp'], [self.patterns[name] for name in phase['patterns']]) for phase in definition['phases']],
+                             key = lambda phase: float('-inf') if phase[0] == 'start' else -phase[0])
+
+
+    def phase_index(self, health, start_health):
+        """ Returns which phase this much health is in, -1 before the first """
+        index = -1
+        for i, (hp, emitters) in enumerate(self.phases):
+            if health <= (start_health - 1 if hp == 'start' else hp):
+                index = i
+        return index
+
+
+    def tuned(self, changes):
+        """ Returns a copy of this boss with some values of its definition changed, e.g. {'phases.1.hp': 600} """
+        definition = copy.deepcopy(self.definition)
+        for path, value in changes.items():
+            keys = [int(part) if part.isdigit() else part for part in path.split('.')]
+            target = definition
+            for part in keys[:-1]:
+                target = target[part]
+            target[keys[-1]] = value
+        return Boss(definition)
+
+
+    @classmethod
+    def load(cls, filename):
+        """ Reads a boss definition from a JSON file """
+        with open(filename) as definition:
+            return cls(json.load(definition))
+
+
+
+BOSSES = {'sky_fight': Boss(SKY_FIGHT), 'drone': Boss(DRONE)}
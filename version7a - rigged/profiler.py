@@ -0,0 +1,235 @@
+import gc
+import json
+import os
+import threading
+import time
+
+import numpy as np
+import pyglet
+
+
+SPAN = 0
+COUNTER = 1
+
+
+class Profiler:
+    """ Times watched methods into a ring buffer, a method is only wrapped while profiling is on so it costs nothing when off """
+    def __init__(self, capacity = 65536):
+        self.capacity = capacity
+        self.names = [None]*capacity
+        self.kinds = np.zeros(capacity, dtype=np.int8)
+        self.starts = np.zeros(capacity)
+        self.ends = np.zeros(capacity)          # the value, for counters
+        self.tids = np.zeros(capacity, dtype=np.int16)
+        self.written = 0
+
+        # watched methods run on the simulation thread as well as the main one, every event keeps a small id of its thread
+        self.lock = threading.Lock()
+        self.threads = dict()       # threading.get_ident() -> (tid, thread name)
+
+        # seconds and calls of every span since the overlay last read them
+        self.totals = dict()
+        self.frames = 0
+
+        self.enabled = False
+        self.watched = []           # (target, attribute, name, group)
+        self.originals = dict()
+        self.gc_started = None
+
+
+    def watch(self, target, attribute, name = None, group = None):
+        """ Times target.attribute while enabled, target may be a class or a single object """
+        entry = (target, attribute, name or attribute, group)
+        self.watched.append(entry)
+        if self.enabled:
+            self.wrap(entry)
+
+
+    def forget(self, group):
+        """ Stops watching everything registered under group """
+        for entry in [entry for entry in self.watched if entry[3] == group]:
+            if self.enabled:
+                self.unwrap(entry)
+            self.watched.remove(entry)
+
+
+    def wrap(self, entry):
+        target, attribute, name, group = entry
+        original = getattr(target, attribute)
+        self.originals[id(target), attribute] = (original, attribute in vars(target))
+        record = self.record
+        clock = time.perf_counter
+
+        # on a class the wrapper becomes the method, on an object it shadows the bound method
+        def timed(*args, **kwargs):
+            start = clock()
+            try:
+                return original(*args, **kwargs)
+            finally:
+                record(name, start, clock())
+        setattr(target, attribute, timed)
+
+
+    def unwrap(self, entry):
+        target, attribute, name, group = entry
+        original, owned = self.originals.pop((id(target), attribute))
+        if owned:
+            setattr(target, attribute, original)
+        else:
+            delattr(target, attribute)
+
+
+    def enable(self):
+        if self.enabled:
+            return
+        self.enabled = True
+        for entry in self.watched:
+            self.wrap(entry)
+        gc.callbacks.append(self.on_gc)
+
+
+    def disable(self):
+        if not self.enabled:
+            return
+        self.enabled = False
+        for entry in self.watched:
+            self.unwrap(entry)
+        gc.callbacks.remove(self.on_gc)
+
+
+    def toggle(self):
+        if self.enabled:
+            self.disable()
+        else:
+            self.enable()
+        return self.enabled
+
+
+    def thread_id(self):
+        ident = threading.get_ident()
+        thread = self.threads.get(ident)
+        if thread is None:
+            thread = self.threads[ident] = (len(self.threads) + 1, threading.current_thread().name)
+        return thread[0]
+
+
+    def record(self, name, start, end, kind = SPAN):
+        with self.lock:
+            i = self.written%self.capacity
+            self.names[i] = name
+            self.kinds[i] = kind
+            self.starts[i] = start
+            self.ends[i] = end
+            self.tids[i] = self.thread_id()
+            self.written += 1
+            if kind == SPAN:
+                total = self.totals.get(name)
+                if total is None:
+                    self.totals[name] = [end - start, 1]
+                else:
+                    total[0] += end - start
+                    total[1] += 1
+
+
+    def counter(self, name, value):
+        self.record(name, time.perf_counter(), value, COUNTER)
+
+
+    def frame(self):
+        self.frames += 1
+
+
+    def on_gc(self, phase, info):
+        if phase == 'start':
+            self.gc_started = time.perf_counter()
+        elif self.gc_started is not None:
+            self.record(f'gc gen{info["generation"]}', self.gc_started, time.perf_counter())
+            self.gc_started = None
+
+
+    def take_totals(self):
+        """ Returns ({name: (ms per frame, calls per frame)}, frames) since the last call, and starts over """
+        with self.lock:
+            taken, self.totals = self.totals, dict()
+        frames = max(self.frames, 1)
+        totals = {name: (1000*seconds/frames, calls/frames) for name, (seconds, calls) in taken.items()}
+        self.frames = 0
+        return (totals, frames)
+
+
+    def events(self):
+        """ Returns the buffered events, the oldest first """
+        with self.lock:
+            written = self.written
+            order = [n%self.capacity for n in range(max(written - self.capacity, 0), written)]
+            events = [(self.names[i], self.kinds[i], self.starts[i], self.ends[i], self.tids[i]) for i in order]
+        yield from events
+
+
+    def dump(self, filename):
+        """ Writes the buffer in the Chrome trace format, for chrome://tracing, Perfetto or speedscope """
+        events = list(self.events())
+        origin = events[0][2] if events else 0
+        trace = [{'name': 'thread_name', 'ph': 'M', 'pid': 1, 'tid': tid, 'args': {'name': thread}}
+                 for tid, thread in list(self.threads.values())]
+        for name, kind, start, end, tid in events:
+            if kind == SPAN:
+                trace.append({'name': name, 'ph': 'X', 'ts': 1e6*(start - origin), 'dur': 1e6*(end - start), 'pid': 1, 'tid': int(tid)})
+            else:
+                trace.append({'name': name, 'ph': 'C', 'ts': 1e6*(start - origin), 'pid': 1, 'tid': int(tid), 'args': {name: end}})
+
+        directory = os.path.dirname(filename)
+        if directory:
+            os.makedirs(directory, exist_ok = True)
+        with open(filename, 'w') as out:
+            json.dump({'traceEvents': trace, 'displayTimeUnit': 'ms'}, out)
+        return len(trace)
+
+
+
+class Overlay:
+    """ Per-frame figures of the profiler in the corner of the window, refreshed a few times a second """
+    def __init__(self, profiler, x, y, interval = 0.5):
+        self.profiler = profiler
+        self.interval = interval
+        self.since_refresh = 0
+        self.counters = dict()
+        self.visible = False
+        self.label = pyglet.text.Label('', font_name = 'Courier New', font_size = 10, x = x, y = y, anchor_y = 'top',
+                                       multiline = True, width = 420, color = (255, 255, 0, 255))
+
+
+    def update(self, dt, **counters):
+        self.counters.update(counters)
+        self.since_refresh += dt
+        if self.since_refresh >= self.interval:
+            self.refresh(self.since_refresh)
+            self.since_refresh = 0
+
+
+    def refresh(self, elapsed):
+        totals, frames = self.profiler.take_totals()
+        lines = [f'{frames/elapsed:5.1f} fps   ms/frame   calls/frame']
+        for name, (ms, calls) in totals.items():
+            lines.append(f'{name:16} {ms:8.3f}   {calls:8.1f}')
+        lines.append('  '.join(f'{name} {value}' for name, value in self.counters.items()))
+        self.label.text = '\n'.join(lines)
+
+
+    def draw(self):
+        if self.visible:
+            self.label.draw()
+
+
+
+def watch_simulation(profiler, group = None):
+    """ The phases of a simulation tick """
+    from simulation import Simulation
+    from events import EventBus
+    profiler.watch(Simulation, 'move', 'move', group)
+    profiler.watch(Simulation, 'fire', 'emit', group)
+    profiler.watch(Simulation, 'check_collision', 'collide', group)
+    profiler.watch(EventBus, 'dispatch', 'events', group)
+
+
+profiler = Profiler()
@@ -0,0 +1,105 @@
+import collections
+import os
+import struct
+
+from pyglet.window import key
+
+
+# the keys the player reads, one bit each
+KEYS = [key.LEFT, key.RIGHT, key.UP, key.DOWN, key.A, key.D, key.W, key.S, key.Z, key.LSHIFT]
+BITS = {symbol: 1 << i for i, symbol in enumerate(KEYS)}
+
+# file layout: a header, then one (keys, ticks) pair per run of ticks with the same keys held
+MAGIC = b'SKYR'
+VERSION = 1
+HEADER = struct.Struct('<4sBHHHIq')     # magic, version, width, height, rate, ticks, score
+RUN = struct.Struct('<HH')              # keys, ticks
+MAX_RUN = 0xFFFF
+
+Replay = collections.namedtuple('Replay', ['width', 'height', 'rate', 'ticks', 'score', 'runs'])
+
+
+def pack(key_handler):
+    """ Returns the held keys as a bitmask """
+    mask = 0
+    for symbol, bit in BITS.items():
+        if key_handler[symbol]:
+            mask |= bit
+    return mask
+
+
+
+class Recorder:
+    """ Logs the keys held on every simulation tick, run-length encoded """
+    def __init__(self, rate = 120):
+        self.rate = rate
+        self.runs = []
+        self.ticks = 0
+
+
+    def record(self, key_handler):
+        mask = pack(key_handler)
+        if self.runs and self.runs[-1][0] == mask and self.runs[-1][1] < MAX_RUN:
+            self.runs[-1][1] += 1
+        else:
+            self.runs.append([mask, 1])
+        self.ticks += 1
+
+
+    def truncate(self, ticks):
+        """ Forgets every tick after the first ticks, for a match put back to an earlier tick """
+        kept = 0
+        for i, run in enumerate(self.runs):
+            if kept + run[1] >= ticks:
+                run[1] = ticks - kept
+                self.runs = self.runs[:i + 1] if run[1] > 0 else self.runs[:i]
+                break
+            kept += run[1]
+        self.ticks = min(self.ticks, ticks)
+
+
+    def replay(self, width, height, score):
+        return Replay(width, height, self.rate, self.ticks, score, [tuple(run) for run in self.runs])
+
+
+
+class ReplayInput:
+    """ Takes the place of a KeyStateHandler, the keys come from a recorded log """
+    def __init__(self, runs):
+        self.runs = runs
+        self.next_run = 0
+        self.end = 0                # the last tick covered by the runs read so far
+        self.mask = 0
+
+
+    def __getitem__(self, symbol):
+        return bool(self.mask & BITS.get(symbol, 0))
+
+
+    def advance(self, tick):
+        while tick > self.end and self.next_run < len(self.runs):
+            self.mask, ticks = self.runs[self.next_run]
+            self.end += ticks
+            self.next_run += 1
+        if tick > self.end:
+            self.mask = 0           # past the end of the log nothing is held
+
+
+
+def save(filename, replay):
+    directory = os.path.dirname(filename)
+    if directory:
+        os.makedirs(directory, exist_ok = True)
+    with open(filename, 'wb') as out:
+        out.write(HEADER.pack(MAGIC, VERSION, replay.width, replay.height, replay.rate, replay.ticks, replay.score))
+        out.write(b''.join(RUN.pack(*run) for run in replay.runs))
+
+
+def load(filename):
+    with open(filename, 'rb') as replay_file:
+        data = replay_file.read()
+    magic, version, width, height, rate, ticks, score = HEADER.unpack_from(data)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError(f'{filename} is not a Sky Fight replay')
+    runs = list(RUN.iter_unpack(data[HEADER.size:]))
+    return Replay(width, height, rate, ticks, score, runs)
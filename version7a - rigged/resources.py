@@ -1,3 +1,6 @@
+import concurrent.futures
+import time
+
 import pyglet
 
 
@@ -7,57 +10,168 @@ def center_image(image):
     image.anchor_y = image.height//2
 
 
-background_image = pyglet.resource.image('res/space.jpg')
+# big enough for the background and every sprite image together
+ATLAS_SIZE = 2048
+
+# images, as name: (file, centered)
+IMAGES = {
+    'background_image': ('res/space.jpg', False),
+
+    # buttons
+    'idle_button': ('res/button0.png', True),
+    'clicked_button': ('res/button1.png', True),
+
+    # ships
+    'player_image': ('res/ship.png', True),
+    'enemy_image': ('res/ship.png', True),
+
+    #bullets
+    'player_laser_image': ('res/player_bullet.png', True),
+    'circle_bullet': ('res/bullet.png', True),
+    'oval_bullet': ('res/oval_bullet.png', True),
+    'circle_bullet_white': ('res/circle_bullet_white.png', True),
+}
+
+# sound effects, decoded up front so they play without delay
+SOUNDS = {
+    'death_sound': 'res/death_sound.wav',
+    'enemy_attack': 'res/ATTACK5.wav',
+    'defeat_sound': 'res/DEFEATED.wav',
+    'damage': 'res/Damage1.wav',
+}
+
+# made on the main thread once the files above are in
+DERIVED = ['player_image_sprite', 'enemy_image_sprite', 'bullet_images', 'ethno']
+
+
+def load_music():
+    return pyglet.media.load('res/THE_WORLD_REVOLVING_Deltarune_OST.wav')
+
+
+# not needed to show the first screen, loaded the first time they are used
+LAZY = {
+    'music': load_music,
+}
+
+
+def decode_image(filename):
+    """ Reads and decodes an image file, safe to run off the main thread since no texture is made """
+    with pyglet.resource.file(filename) as image_file:
+        return pyglet.image.load(filename, file = image_file)
+
+
+def finish_loading(assets):
+    """ Makes everything that is built from the loaded files """
+    player_image_sprite = pyglet.sprite.Sprite(assets['player_image'])
+    player_image_sprite.scale = 0.3
+    assets['player_image_sprite'] = player_image_sprite
+
+    enemy_image_sprite = pyglet.sprite.Sprite(assets['enemy_image'])
+    enemy_image_sprite.scale = 0.8
+    enemy_image_sprite.rotation = 180
+    assets['enemy_image_sprite'] = enemy_image_sprite
+
+    # ordered by the bullet kinds in bullets.py
+    assets['bullet_images'] = [assets['player_laser_image'], assets['circle_bullet'], assets['circle_bullet_white'], assets['oval_bullet']]
+
+    #fonts
+    pyglet.font.add_file('res/ethnocentric_rg.ttf')
+    assets['ethno'] = pyglet.font.load('ethnocentrig rg')
+
+
+
+class AssetManager:
+    """ Decodes the files on worker threads, while the main thread keeps drawing and uploads what is ready """
+    def __init__(self, workers = 4):
+        self.workers = workers
+        self.executor = None
+        self.futures = dict()
+        self.total = 0
+        self.done = 0
+
+        # every image goes into one texture, so the sprites of a screen share a single bind
+        self.atlas = None
+        self.regions = dict()
 
+        # seconds from start to the last essential asset
+        self.started = None
+        self.startup_time = None
 
-# buttons
-idle_button = pyglet.resource.image('res/button0.png')
-center_image(idle_button)
 
-clicked_button = pyglet.resource.image('res/button1.png')
-center_image(clicked_button)
+    def start(self):
+        if self.started is not None:
+            return
+        self.started = time.perf_counter()
 
+        # the resource index is built here, before the workers start reading from it
+        pyglet.resource.reindex()
+        self.executor = concurrent.futures.ThreadPoolExecutor(self.workers)
+        for name, (filename, centered) in IMAGES.items():
+            self.futures[name] = self.executor.submit(decode_image, filename)
+        for name, filename in SOUNDS.items():
+            self.futures[name] = self.executor.submit(pyglet.media.load, filename, streaming = False)
+        self.total = len(self.futures) + 1
 
-# ships
-player_image = pyglet.resource.image('res/ship.png')
-center_image(player_image)
-player_image_sprite = pyglet.sprite.Sprite(player_image)
-player_image_sprite.scale = 0.3
 
-enemy_image = pyglet.resource.image('res/ship.png')
-center_image(enemy_image)
-enemy_image_sprite = pyglet.sprite.Sprite(enemy_image)
-enemy_image_sprite.scale = 0.8
-enemy_image_sprite.rotation = 180
+    @property
+    def progress(self):
+        return self.done/self.total if self.total else 0
 
 
-#bullets
-player_laser_image = pyglet.resource.image('res/player_bullet.png')
-center_image(player_laser_image)
-player_laser_image_sprite = pyglet.sprite.Sprite(player_laser_image)
+    @property
+    def ready(self):
+        return self.startup_time is not None
 
-circle_bullet = pyglet.resource.image('res/bullet.png')
-center_image(circle_bullet)
-circle_bullet_sprite = pyglet.sprite.Sprite(circle_bullet)
 
-oval_bullet = pyglet.resource.image('res/oval_bullet.png')
-center_image(oval_bullet)
+    def poll(self):
+        """ Finishes whatever the workers have decoded, on the calling thread, returns True once everything is in """
+        if self.ready:
+            return True
 
-circle_bullet_white = pyglet.resource.image('res/circle_bullet_white.png')
-center_image(circle_bullet_white)
+        for name, future in list(self.futures.items()):
+            if future.done():
+                del self.futures[name]
+                asset = future.result()
+                globals()[name] = self.finish_image(name, asset) if name in IMAGES else asset
+                self.done += 1
 
-blue_laser = pyglet.resource.image('res/blue_laser.png')
-center_image(blue_laser)
+        if self.started is not None and not self.futures:
+            finish_loading(globals())
+            self.done += 1
+            self.startup_time = time.perf_counter() - self.started
+            self.executor.shutdown(wait = False)
+        return self.ready
 
 
-# sounds
-music = pyglet.media.load('res/THE_WORLD_REVOLVING_Deltarune_OST.wav')
-death_sound = pyglet.media.load('res/death_sound.wav')
-enemy_attack = pyglet.media.load('res/ATTACK5.wav', streaming = False)
-defeat_sound = pyglet.media.load('res/DEFEATED.wav', streaming = False)
-damage = pyglet.media.load('res/Damage1.wav', streaming = False)
+    def finish_image(self, name, image):
+        """ Packs a decoded image into the atlas, this needs the GL context of the main thread """
+        filename, centered = IMAGES[name]
+        if filename not in self.regions:
+            if self.atlas is None:
+                self.atlas = pyglet.image.atlas.TextureBin(ATLAS_SIZE, ATLAS_SIZE)
+            self.regions[filename] = self.atlas.add(image)
+        region = self.regions[filename]
+        if centered:
+            center_image(region)
+        return region
+
+
+    def wait(self):
+        """ Loads everything before returning, for callers that have no loading screen to show """
+        self.start()
+        concurrent.futures.wait(list(self.futures.values()))
+        return self.poll()
+
+
+manager = AssetManager()
 
 
-#fonts
-pyglet.font.add_file('res/ethnocentric_rg.ttf')
-ethno = pyglet.font.load('ethnocentrig rg')
+def __getattr__(name):
+    """ Gives lazy assets on first use, and blocks for the others if they are asked for before they are in """
+    if name in LAZY:
+        globals()[name] = LAZY[name]()
+        return globals()[name]
+    if name in IMAGES or name in SOUNDS or name in DERIVED:
+        manager.wait()
+        return globals()[name]
+    raise AttributeError(f"module 'resources' has no attribute '{name}'")
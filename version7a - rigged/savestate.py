@@ -0,0 +1,177 @@
+import os
+import struct
+import time
+import zlib
+
+import numpy as np
+
+from entities import UNPHASED
+from patterns import BOSSES
+from replay import RUN
+
+
+# a snapshot: the header, every player, every enemy, then each bullet store as its count and columns
+MAGIC = b'SKYS'
+VERSION = 3
+HEADER = struct.Struct('<4sBIqd?BB')    # magic, version, tick, score, time bonus, finished, players, enemies
+PLAYER = struct.Struct('<4d2id')        # x, y, prev_x, prev_y, lives, invincibility, time since fire
+ENEMY = struct.Struct('<6diidB?')       # x, y, prev_x, prev_y, velx, vely, health, start health, hitbox radius, boss, still in the match
+
+# an enemy's boss is saved as its place in BOSSES, one that is not there cannot be sent in again
+BOSS_NAMES = list(BOSSES)
+UNKNOWN_BOSS = 255
+STORE = struct.Struct('<Iq')            # bullets, next id
+
+# a saved game on disk: the compressed snapshot, then the keys recorded so far as replay runs
+FILE_MAGIC = b'SKYP'
+FILE_HEADER = struct.Struct('<4sBII16s')    # magic, version, snapshot bytes, runs, wave script name
+
+
+def store_columns(store):
+    return [name for name in store.columns if name != 'alive']
+
+
+def snapshot(sim):
+    """ Returns the whole state of a match as bytes """
+    parts = [HEADER.pack(MAGIC, VERSION, sim.tick_counter, sim.score, sim.score_timebonus, sim.finished, len(sim.players), len(sim.all_enemies))]
+    for player in sim.players:
+        parts.append(PLAYER.pack(player.x, player.y, player.prev_x, player.prev_y, player.lives, player.invincibility, player.time_elapsed_since_fire))
+    bosses = {id(boss): i for i, boss in enumerate(BOSSES.values())}
+    for enemy in sim.all_enemies:
+        parts.append(ENEMY.pack(enemy.x, enemy.y, enemy.prev_x, enemy.prev_y, enemy.velx, enemy.vely, enemy.health, enemy.start_health,
+                                enemy.hitbox_radius, bosses.get(id(enemy.boss), UNKNOWN_BOSS), enemy in sim.enemies))
+    for store in [sim.player_bullets, sim.enemy_bullets]:
+        parts.append(STORE.pack(store.count, store.next_id))
+        for name in store_columns(store):
+            parts.append(getattr(store, name)[:store.count].tobytes())
+    return b''.join(parts)
+
+
+def tick_of(state):
+    return HEADER.unpack_from(state)[2]
+
+
+def restore(sim, state):
+    """ Puts a match back the way it was when the snapshot was taken, sim must have the same players """
+    magic, version, tick, score, timebonus, finished, players, enemies = HEADER.unpack_from(state)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError('not a Sky Fight snapshot')
+    if players != len(sim.players):
+        raise ValueError(f'the snapshot has {players} players, the match {len(sim.players)}')
+    offset = HEADER.size + players*PLAYER.size
+    records = [ENEMY.unpack_from(state, offset + i*ENEMY.size) for i in range(enemies)]
+
+    # enemies the match has not sent in yet, like the waves of a match resumed after a restart, are sent in now
+    missing = records[len(sim.all_enemies):]
+    if any(record[9] == UNKNOWN_BOSS for record in missing):
+        raise ValueError('the snapshot has enemies of a boss that is not in BOSSES')
+    for x, y, prev_x, prev_y, velx, vely, health, start_health, radius, boss, alive in missing:
+        sim.spawn_enemies(x, y, BOSSES[BOSS_NAMES[boss]], start_health, radius, vely)
+
+    sim.tick_counter, sim.score, sim.score_timebonus, sim.finished = (tick, score, timebonus, finished)
+    offset = HEADER.size
+    for player in sim.players:
+        player.x, player.y, player.prev_x, player.prev_y, player.lives, player.invincibility, player.time_elapsed_since_fire = PLAYER.unpack_from(state, offset)
+        offset += PLAYER.size
+
+    # enemies sent in after the snapshot was taken were never there
+    sim.enemy_store.despawn([enemy.handle for enemy in sim.all_enemies[enemies:]])
+    del sim.all_enemies[enemies:]
+    sim.enemies[:] = []
+    for enemy, record in zip(sim.all_enemies, records):
+        enemy.x, enemy.y, enemy.prev_x, enemy.prev_y, enemy.velx, enemy.vely, enemy.health, enemy.start_health, enemy.hitbox_radius, boss, alive = record
+        enemy.phase_health = UNPHASED       # the firing phase is worked out again from the health
+        enemy.active = alive
+        if alive:
+            sim.enemies.append(enemy)
+    offset += enemies*ENEMY.size
+
+    for store in [sim.player_bullets, sim.enemy_bullets]:
+        count, store.next_id = STORE.unpack_from(state, offset)
+        offset += STORE.size
+        store.grow(count)
+        for name in store_columns(store):
+            column = getattr(store, name)
+            size = count*column.itemsize
+            column[:count] = np.frombuffer(state, column.dtype, count, offset)
+            offset += size
+        store.alive[:count] = True
+        store.alive[count:max(count, store.count)] = False
+        store.count = count
+    return tick
+
+
+
+class SaveStates:
+    """ A ring of the latest snapshots of a match, one every `every` ticks, the oldest is dropped once it is full """
+    def __init__(self, every = 12, capacity = 300):
+        self.every = every
+        self.capacity = capacity
+        self.slots = [None]*capacity        # (tick, snapshot)
+        self.written = 0
+
+        # seconds spent taking snapshots, and the slowest one
+        self.taken = 0
+        self.seconds = 0
+        self.slowest = 0
+
+
+    def __len__(self):
+        return min(self.written, self.capacity)
+
+
+    def offer(self, sim):
+        """ Takes a snapshot if this tick is one of the every-th """
+        if sim.tick_counter%self.every != 0:
+            return
+        start = time.perf_counter()
+        self.push(snapshot(sim))
+        elapsed = time.perf_counter() - start
+        self.taken += 1
+        self.seconds += elapsed
+        self.slowest = max(self.slowest, elapsed)
+
+
+    def push(self, state):
+        self.slots[self.written%self.capacity] = (tick_of(state), state)
+        self.written += 1
+
+
+    def rewind(self, sim, ticks):
+        """ Puts the match back to the newest snapshot at least ticks old, the newer ones are dropped, returns its tick or None """
+        target = sim.tick_counter - ticks
+        while len(self) > 0:
+            tick, state = self.slots[(self.written - 1)%self.capacity]
+            if tick <= target or len(self) == 1:
+                return restore(sim, state)
+            self.written -= 1
+        return None
+
+
+
+def save(filename, state, runs, waves = None):
+    """ Writes a snapshot and the recorded key runs, so a paused game can go on after a restart, waves names the match's wave script """
+    directory = os.path.dirname(filename)
+    if directory:
+        os.makedirs(directory, exist_ok = True)
+    packed = zlib.compress(state, 1)
+    temp = filename + '.tmp'
+    with open(temp, 'wb') as out:
+        out.write(FILE_HEADER.pack(FILE_MAGIC, VERSION, len(packed), len(runs), (waves or '').encode()))
+        out.write(packed)
+        out.write(b''.join(RUN.pack(*run) for run in runs))
+        out.flush()
+        os.fsync(out.fileno())
+    os.replace(temp, filename)
+
+
+def load(filename):
+    """ Returns the snapshot, the key runs and the wave script name, None for none, of a saved game """
+    with open(filename, 'rb') as saved:
+        data = saved.read()
+    magic, version, size, runs, waves = FILE_HEADER.unpack_from(data)
+    if magic != FILE_MAGIC or version != VERSION:
+        raise ValueError(f'{filename} is not a Sky Fight saved game')
+    start = FILE_HEADER.size
+    state = zlib.decompress(data[start:start + size])
+    return (state, [list(run) for run in RUN.iter_unpack(data[start + size:start + size + runs*RUN.size])], waves.rstrip(b'\0').decode() or None)
@@ -0,0 +1,125 @@
+import heapq
+import json
+import os
+
+
+class ScoreBoard:
+    """ Every finished run is appended to a journal, the top scores and per-player bests are kept in memory """
+    def __init__(self, filename = 'scores.json', journal = 'scores.journal', legacy = 'scores.txt', top_k = 5, compact_every = 256):
+        self.filename = filename
+        self.journal = journal
+        self.top_k = top_k
+        self.compact_every = compact_every
+
+        # runs counts every run ever played, it numbers the journal entries too
+        self.runs = 0
+        self.heap = []              # min-heap of (score, -run, name, replay), the worst of the top scores on top
+        self.bests = dict()
+        self.pending = 0            # journal entries since the last compaction
+        self.torn = False           # the journal ends in a line cut short by a crash
+
+        if os.path.exists(self.filename):
+            self.load_snapshot()
+        elif os.path.exists(legacy):
+            self.load_legacy(legacy)
+        self.replay_journal()
+
+
+    def load_snapshot(self):
+        with open(self.filename) as snapshot:
+            data = json.load(snapshot)
+        self.runs = data['runs']
+        # snapshots written before replays were kept have no replay in their entries
+        self.heap = [(entry[1], -entry[2], entry[0], entry[3] if len(entry) > 3 else None) for entry in data['top']]
+        heapq.heapify(self.heap)
+        self.bests = data['bests']
+
+
+    def load_legacy(self, legacy):
+        """ Takes in the old scores.txt, one 'name score' per line """
+        with open(legacy) as scores:
+            for line in scores:
+                name, _, score = line.strip().rpartition(' ')
+                if name and score.isdigit():
+                    self.insert(name, int(score), self.runs + 1)
+
+
+    def replay_journal(self):
+        if not os.path.exists(self.journal):
+            return
+        with open(self.journal) as journal:
+            for line in journal:
+                self.torn = not line.endswith('\n')
+                try:
+                    run, name, score, replay = (json.loads(line) + [None])[:4]
+                except ValueError:
+                    continue            # a line cut short by a crash
+                # runs already in the snapshot are left out, in case the last compaction stopped halfway
+                if run > self.runs:
+                    self.insert(name, score, run, replay)
+                    self.pending += 1
+
+
+    def insert(self, name, score, run, replay = None):
+        """ Puts a run in the in-memory index, returns True if it made the top scores """
+        self.runs = run
+        if score > self.bests.get(name, -1):
+            self.bests[name] = score
+
+        # on equal scores the older run keeps its place, runs are never equal so the replay is never compared
+        entry = (score, -run, name, replay)
+        if len(self.heap) < self.top_k:
+            heapq.heappush(self.heap, entry)
+            return True
+        if entry > self.heap[0]:
+            heapq.heapreplace(self.heap, entry)
+            return True
+        return False
+
+
+    def add(self, name, score, replay = None):
+        """ Records a finished run, and the replay that reproduces it, returns True if it made the top scores """
+        run = self.runs + 1
+        with open(self.journal, 'a') as journal:
+            # a torn last line gets finished first, so the new entry starts on its own line
+            journal.write(('\n' if self.torn else '') + json.dumps([run, name, score, replay]) + '\n')
+            journal.flush()
+            os.fsync(journal.fileno())
+        self.pending += 1
+        self.torn = False
+
+        is_top = self.insert(name, score, run, replay)
+        if self.pending >= self.compact_every:
+            self.compact()
+        return is_top
+
+
+    def compact(self):
+        """ Folds the journal into the snapshot, the journal itself is kept as a segment named after its last run """
+        data = {
+            'runs': self.runs,
+            'top': [[name, score, -neg_run, replay] for score, neg_run, name, replay in self.heap],
+            'bests': self.bests,
+        }
+        write_atomic(self.filename, json.dumps(data))
+
+        # the segments and the journal together hold every run ever played, a crash before this leaves runs the snapshot skips
+        if os.path.exists(self.journal):
+            os.replace(self.journal, f'{self.journal}.{self.runs}')
+        self.pending = 0
+
+
+    def top(self):
+        """ Returns the top scores as (name, score) pairs, the highest first """
+        return [(name, score) for score, neg_run, name, replay in sorted(self.heap, reverse = True)]
+
+
+
+def write_atomic(filename, text):
+    """ Writes a file so that it holds either the old or the new text, never a mix """
+    temp = filename + '.tmp'
+    with open(temp, 'w') as out:
+        out.write(text)
+        out.flush()
+        os.fsync(out.fileno())
+    os.replace(temp, filename)
@@ -0,0 +1,99 @@
+import collections
+import contextlib
+import threading
+import time
+
+import numpy as np
+
+
+# all drawing needs of one tick, built by the simulation thread and never changed after
+#
+#   players     (x, y, prev_x, prev_y, invincibility) of every player
+#   enemies     (enemy, (x, y, prev_x, prev_y)) of every enemy in play, the enemy only tells which sprite is moved
+#   bullets     a BulletFrame of the player bullets and one of the enemy bullets
+#   hud         (enemy hp, lives, score)
+RenderState = collections.namedtuple('RenderState', ['tick', 'stamp', 'players', 'enemies', 'bullets', 'hud', 'over'])
+
+
+def capture(sim, player, over):
+    """ Returns the RenderState of a match as it is now, player is the one whose lives are shown """
+    players = tuple((p.x, p.y, p.prev_x, p.prev_y, p.invincibility) for p in sim.players)
+
+    # every enemy is read from the store at once instead of a column at a time
+    store = sim.enemy_store
+    rows = np.array([enemy.row for enemy in sim.enemies], dtype=np.int64)
+    positions = zip(store.x[rows].tolist(), store.y[rows].tolist(), store.prev_x[rows].tolist(), store.prev_y[rows].tolist())
+    enemies = tuple(zip(sim.enemies, positions))
+
+    bullets = (sim.player_bullets.frame(), sim.enemy_bullets.frame())
+    return RenderState(sim.tick_counter, time.perf_counter(), players, enemies, bullets, (sim.enemy.health, player.lives, sim.score), over)
+
+
+
+class SimulationThread:
+    """ Steps a match at a fixed rate on a thread of its own, drawing only ever reads the RenderStates it publishes
+
+    The next state is built while the main thread draws the published one, and publishing swaps a single reference,
+    so neither side waits on the other. The match is anything with tick(dt) and render_state(), the main thread holds
+    it between two ticks with paused() to change it.
+    """
+    def __init__(self, match, rate = 120, max_behind = 8):
+        self.match = match
+        self.step = 1/rate
+        self.max_behind = max_behind        # ticks the thread may fall behind before it gives the backlog up
+        self.front = None                   # the latest published RenderState
+        self.lock = threading.Lock()        # held for every tick
+        self.running = False
+        self.thread = None
+
+        self.ticks = 0
+        self.dropped = 0                    # seconds of game time given up, like FixedTimestep.dropped
+        self.busy = 0                       # seconds spent on ticks
+
+
+    def start(self):
+        self.running = True
+        self.front = self.match.render_state()
+        self.thread = threading.Thread(target = self.run, name = 'simulation', daemon = True)
+        self.thread.start()
+
+
+    def stop(self):
+        self.running = False
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+
+    def run(self):
+        next_tick = time.perf_counter()
+        while self.running:
+            start = time.perf_counter()
+            with self.lock:
+                # an ended match stands still until the main thread has moved on
+                if not self.front.over:
+                    self.match.tick(self.step)
+                    self.front = self.match.render_state()
+                    self.ticks += 1
+            now = time.perf_counter()
+            self.busy += now - start
+
+            next_tick += self.step
+            if next_tick > now:
+                time.sleep(next_tick - now)
+            elif now - next_tick > self.max_behind*self.step:
+                self.dropped += now - next_tick
+                next_tick = now
+
+
+    def alpha(self, state):
+        """ How far the next tick after state has come, for drawing in between two ticks """
+        return min(max((time.perf_counter() - state.stamp)/self.step, 0), 1)
+
+
+    @contextlib.contextmanager
+    def paused(self):
+        """ Holds the thread between two ticks, the state is published again afterwards so drawing sees the change """
+        with self.lock:
+            yield
+            self.front = self.match.render_state()
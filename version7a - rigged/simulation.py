@@ -0,0 +1,181 @@
+import numpy as np
+
+from utils import Player, Enemy, NullSprite
+from bullets import BulletStore
+from entities import Enemies
+from collision import SpatialGrid, CollisionReport
+from events import EventBus
+
+
+class Simulation:
+    """ The rules of a match: movement, firing, collisions and scoring, with no window, drawing or audio of its own """
+    def __init__(self, width, height, player_sprite, enemy_sprite):
+        self.width = width
+        self.height = height
+        self.center_x, self.center_y = (width//2, height//2)
+        self.bounds = (0.75*width, height)
+
+        # what happens in the match is published here, for sound and anything else that wants to know
+        self.events = EventBus()
+
+        # create the elements of the game, every enemy is a row of one store that moves and fires them all at once
+        self.enemy_store = Enemies()
+        self.player = Player(self.center_x*3/4, self.center_y//3, player_sprite, 5)
+        self.enemy = Enemy(self.center_x*3/4, 7*self.center_y//4, enemy_sprite, 50, self.enemy_store)
+        self.players = [self.player]
+        self.enemies = [self.enemy]
+        self.all_enemies = list(self.enemies)      # down or not
+
+        # a WaveScript sends in more enemies as the match goes on, make_sprite gives each of them a sprite
+        self.waves = None
+        self.make_sprite = NullSprite
+
+        # bullets are plain numbers, a BulletRenderer draws them straight from the arrays
+        self.player_bullets = BulletStore()
+        self.enemy_bullets = BulletStore()
+        self.grid = SpatialGrid(self.bounds[0], self.bounds[1])
+
+        # set up tick control and bonus
+        self.tick_counter = 0
+        self.score = 0
+        self.score_timebonus = 750000
+        self.finished = False
+
+        # what the score is made of
+        self.timebonus_decay = 75
+        self.hit_score = 3000
+        self.graze_score = 25
+        self.graze_radius = 50
+
+
+    def step(self, dt, key_handler):
+        """ Advances the match by one tick """
+        self.tick_counter += 1
+        self.score_timebonus -= self.timebonus_decay
+        if self.waves is not None:
+            self.waves.update(self)
+        self.move(dt, key_handler)
+        self.fire(dt, key_handler)
+        return self.check_collision()
+
+
+    def move(self, dt, key_handler):
+        """ Updates player and enemy and bullets """
+        for player in self.players:
+            player.update(dt, self.keys(player, key_handler), self.bounds)
+        for enemy in self.enemy_store.update(dt, bounds = self.bounds):
+            self.enemies.remove(enemy)
+            self.events.publish('enemy_left', enemy = enemy)
+        self.player_bullets.update(dt, self.bounds)
+        self.enemy_bullets.update(dt, self.bounds)
+
+
+    def fire(self, dt, key_handler):
+        """ Alive player or enemy will fire bullets """
+        for player in self.players:
+            player.fire(dt, self.keys(player, key_handler), self.tick_counter, self.player_bullets)
+        fired = self.enemy_store.fire(self.player, self.tick_counter, self.enemy_bullets)
+        if fired > 0:
+            self.events.publish('volley_fired', bullets = fired)
+
+
+    def keys(self, player, key_handler):
+        return key_handler if player.controls is None else player.controls
+
+
+    def spawn_enemies(self, x, y, boss, health, radius, vely = -1):
+        """ Sends in a group of enemies at once, x and y may be arrays, returns them """
+        handles = self.enemy_store.spawn_enemies(x, y, boss, health, radius, vely)
+        enemies = [Enemy.view(self.enemy_store, handle, self.make_sprite()) for handle in handles]
+        self.enemies.extend(enemies)
+        self.all_enemies.extend(enemies)
+        return enemies
+
+
+    def add_player(self, sprite, controls = None):
+        """ Adds another player, controls is where its keys come from """
+        player = Player(self.center_x*3/4, self.center_y//3, sprite, 5)
+        player.controls = controls
+        self.players.append(player)
+        return player
+
+
+    def check_collision(self):
+        hits = 0
+        grazes = 0
+        kills = []
+
+        # when player bullets hit an enemy, every hit takes one hp until the enemy is down, many enemies go through the grid
+        spent = np.zeros(len(self.player_bullets), dtype=bool)
+        for row, touched in self.enemy_store.hits(self.player_bullets, self.grid):
+            enemy = self.enemy_store.view[row]
+            landed = touched[~spent[touched]][:max(enemy.health, 0)]
+            if len(landed) == 0:
+                continue
+            spent[landed] = True
+            hits += len(landed)
+            enemy.health -= len(landed)
+            self.score += self.hit_score*len(landed)
+
+            # the boss has the sounds and the end of the match, a drone of the waves only leaves the screen
+            boss = enemy is self.enemy
+            self.events.publish('enemy_hit' if boss else 'drone_hit', enemy = enemy, hits = len(landed))
+            if enemy.health <= 0:
+                self.enemies.remove(enemy)
+                enemy.active = False
+                kills.append(enemy)
+                if not boss:
+                    self.events.publish('drone_downed', enemy = enemy)
+                    continue
+                #self.score += round(self.score_timebonus)
+                self.events.publish('enemy_defeated', enemy = enemy)
+                for player in self.players:
+                    player.invincibility = 1200
+        self.player_bullets.remove(np.flatnonzero(spent))
+
+        # when enemy bullets hit a player, only the first hit counts
+        self.grid.build(self.enemy_bullets)
+        spent = np.zeros(len(self.enemy_bullets), dtype=bool)
+        for player in self.players:
+            contact = self.grid.collide(player, self.graze_radius)
+            grazed = contact.grazes
+            landed = contact.hits[~spent[contact.hits]] if player.invincibility == 0 else contact.hits[:0]
+            if len(landed) > 0:
+                # bullets behind the fatal one never got to graze
+                grazed = grazed[grazed < landed[0]]
+                spent[landed[0]] = True
+                hits += 1
+                player.lives -= 1
+                self.events.publish('player_hit', player = player)
+                if player.lives < 0:
+                    kills.append(player)
+                    self.events.publish('player_died', player = player)
+                player.invincibility = 300
+                #self.score -= 250000
+                player.move_to(self.center_x*3/4, self.center_y//3)
+            grazes += len(grazed)
+            self.score += self.graze_score*len(grazed)
+        self.enemy_bullets.remove(np.flatnonzero(spent))
+
+        return CollisionReport(hits, grazes, kills)
+
+
+    @property
+    def won(self):
+        return self.enemy.health <= 0
+
+
+    @property
+    def over(self):
+        """ The match ends once the enemy or every player is down and the last enemy bullet is gone """
+        players_down = all(player.lives < 0 for player in self.players)
+        return (len(self.enemies) < 1 or players_down) and len(self.enemy_bullets) < 1
+
+
+    def finish(self):
+        """ Adds the time bonus of a won match to the score, only once """
+        if not self.finished:
+            self.finished = True
+            if self.won:
+                self.score += round(self.score_timebonus)
+        return self.score
@@ -0,0 +1,75 @@
+import collections
+import math
+import numpy as np
+
+
+class SpawnTable:
+    """ One volley worked out ahead of time, every bullet relative to the shooter and its aim """
+    def __init__(self, offset_x, speed, spin, scale, radius, kind):
+        offset_x, speed, spin, scale, radius, kind = np.broadcast_arrays(offset_x, speed, spin, scale, radius, kind)
+        self.offset_x = offset_x.astype(float)
+        self.spin = spin.astype(float)
+        self.scale = scale.astype(float)
+        self.radius = radius.astype(float)
+        self.kind = kind.astype(np.int8)
+
+        # velocity of every bullet for a shooter aiming straight up, rotated by the aim when fired
+        self.forward = speed*np.cos(np.radians(spin))
+        self.side = speed*np.sin(np.radians(spin))
+
+
+    def __len__(self):
+        return len(self.kind)
+
+
+    def fire(self, x, y, sin_aim, cos_aim, aim, bullets):
+        """ Writes the whole volley into bullets, aim is in degrees and its sine and cosine are given """
+        velx = sin_aim*self.forward + cos_aim*self.side
+        vely = cos_aim*self.forward - sin_aim*self.side
+        return bullets.append(x + self.offset_x, y, velx, vely, aim + self.spin, self.scale, self.radius, self.kind)
+
+
+    def fire_many(self, x, y, sin_aim, cos_aim, aim, bullets):
+        """ Writes the volley once for every shooter, x, y and the aim are arrays with one entry per shooter """
+        sin_aim = sin_aim[:, None]
+        cos_aim = cos_aim[:, None]
+        velx = sin_aim*self.forward + cos_aim*self.side
+        vely = cos_aim*self.forward - sin_aim*self.side
+        columns = np.broadcast_arrays(x[:, None] + self.offset_x, y[:, None], velx, vely, aim[:, None] + self.spin, self.scale, self.radius, self.kind)
+        return bullets.append(*[column.ravel() for column in columns])
+
+
+
+class PatternTables:
+    """ The spawn tables of one pattern over its tick cycle, built on first use and kept in a bounded cache """
+    def __init__(self, build, cycle, maxsize = 64):
+        # build(tick) returns the SpawnTable fired on that tick of the cycle
+        self.build = build
+        self.cycle = cycle
+        self.maxsize = maxsize
+        self.cache = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+
+    def table(self, tick):
+        key = tick%self.cycle
+        table = self.cache.get(key)
+        if table is not None:
+            self.hits += 1
+            self.cache.move_to_end(key)
+            return table
+
+        self.misses += 1
+        table = self.build(key)
+        self.cache[key] = table
+        if len(self.cache) > self.maxsize:
+            self.cache.popitem(last = False)
+        return table
+
+
+    def fire(self, shooter, target, tick, bullets):
+        """ Fires the volley of this tick from the shooter, aimed at atan(dx/dy) degrees off straight down towards the target """
+        slope = (target.x - shooter.x)/(target.y - shooter.y)
+        cos_aim = 1/math.sqrt(1 + slope*slope)
+        return self.table(tick).fire(shooter.x, shooter.y, slope*cos_aim, cos_aim, math.degrees(math.atan(slope)), bullets)
@@ -0,0 +1,30 @@
+class FixedTimestep:
+    """ Calls a step function at a fixed rate, however often or seldom advance is called """
+    def __init__(self, rate = 120, max_steps = 8):
+        self.step = 1/rate
+        self.max_steps = max_steps
+        self.accumulator = 0
+        self.alpha = 0
+
+        # seconds of game time given up because the host fell too far behind
+        self.dropped = 0
+
+
+    def advance(self, dt, step_function):
+        """ Runs as many whole steps as dt covers, at most max_steps, returns how many ran """
+        self.accumulator += dt
+        steps = 0
+        while self.accumulator >= self.step and steps < self.max_steps:
+            step_function(self.step)
+            self.accumulator -= self.step
+            steps += 1
+
+        # too far behind to catch up, drop the backlog instead of spiraling
+        if self.accumulator >= self.step:
+            backlog = self.accumulator - self.accumulator%self.step
+            self.dropped += backlog
+            self.accumulator -= backlog
+
+        # how far the next step has come, for drawing in between two steps
+        self.alpha = self.accumulator/self.step
+        return steps
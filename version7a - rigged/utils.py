@@ -1,16 +1,24 @@
 import math
+import numpy as np
 import pyglet
 from pyglet.window import key
 
-import resources
+from bullets import PLAYER_LASER
+from patterns import BOSSES
+from entities import Enemies, Column, UNPHASED
 
 
 class Button:
-    def __init__(self, x, y, text_size_tuple):
+    def __init__(self, x, y, text_size_tuple, batch = None):
+        # imported here so the game objects below can be used without a window or GL context
+        import resources
+        import layers
+
         # button constants
-        idle_button = pyglet.sprite.Sprite(resources.idle_button, x = x, y = y)
-        clicked_button = pyglet.sprite.Sprite(resources.clicked_button, x = x, y = y)
-        label = pyglet.text.Label(text = text_size_tuple[0], font_name='ethnocentric rg', font_size = text_size_tuple[1], x = x, y = y, anchor_x = 'center', anchor_y = 'center')
+        idle_button = pyglet.sprite.Sprite(resources.idle_button, x = x, y = y, batch = batch, group = layers.BUTTONS)
+        clicked_button = pyglet.sprite.Sprite(resources.clicked_button, x = x, y = y, batch = batch, group = layers.BUTTONS)
+        clicked_button.visible = False
+        label = pyglet.text.Label(text = text_size_tuple[0], font_name='ethnocentric rg', font_size = text_size_tuple[1], x = x, y = y, anchor_x = 'center', anchor_y = 'center', batch = batch, group = layers.LABELS)
 
         self.x = x
         self.y = y
@@ -36,26 +44,54 @@ class Button:
 
 
     def on_hover(self, tx, ty):
-        batch = self.sprite.batch
-        self.sprite.batch = None
-        if self.is_on(tx, ty):
-            self.sprites[1].batch = batch
-            self.sprite = self.sprites[1]
-        else:
-            self.sprites[0].batch = batch
-            self.sprite = self.sprites[0]
+        # both sprites stay in the batch, hovering only swaps which one is visible
+        sprite = self.sprites[1] if self.is_on(tx, ty) else self.sprites[0]
+        if sprite is not self.sprite:
+            self.sprite.visible = False
+            sprite.visible = True
+            self.sprite = sprite
 
 
 ############################################################################################################################################
 
 
+class NullSprite:
+    """ Takes the place of a pyglet sprite when nothing is drawn """
+    def __init__(self, width = 0, height = 0):
+        self.x = 0
+        self.y = 0
+        self.width = width
+        self.height = height
+        self.scale = 1
+        self.rotation = 0
+        self.opacity = 255
+        self.visible = True
+        self.batch = None
+
+
+    def draw(self):
+        pass
+
+
+    def delete(self):
+        pass
+
+
+
 class GameObject:
     def __init__(self, x, y, sprite):
         self.x = x
         self.y = y
+        # where the object was one tick ago, sprites are drawn in between
+        self.prev_x = x
+        self.prev_y = y
         self.velx = 0
         self.vely = 0
 
+        self.set_sprite(sprite)
+
+
+    def set_sprite(self, sprite):
         self.sprite = sprite
         self.width = self.sprite.width
         self.height = self.sprite.height
@@ -68,10 +104,22 @@ class GameObject:
 
 
     def update(self, dt):
+        self.prev_x, self.prev_y = (self.x, self.y)
         self.x += self.velx*dt
         self.y += self.vely*dt
-        self.sprite.x = self.x
-        self.sprite.y = self.y
+
+
+    def move_to(self, x, y):
+        """ Jumps to a point without drawing the way in between """
+        self.x, self.y = (x, y)
+        self.prev_x, self.prev_y = (x, y)
+
+
+    def sync(self, alpha, state = None):
+        """ Places the sprite alpha of the way from the previous tick to the current one, state is (x, y, prev_x, prev_y) if not the object's own """
+        x, y, prev_x, prev_y = (self.x, self.y, self.prev_x, self.prev_y) if state is None else state[:4]
+        self.sprite.x = prev_x + (x - prev_x)*alpha
+        self.sprite.y = prev_y + (y - prev_y)*alpha
 
 
 
@@ -82,12 +130,16 @@ class Player(GameObject):
         self.invincibility = 0
         self.hitbox_radius = radius
 
+        # where the keys come from, None takes the ones given to Simulation.step
+        self.controls = None
+
         self.speed = 600
         self.fire_rate = 1/10
         self.time_elapsed_since_fire = 0
 
 
     def update(self, dt, key_handler, bounds = (1024, 768)):
+        self.prev_x, self.prev_y = (self.x, self.y)
         if key_handler[key.LSHIFT]:
             self.speed = 300
         else:
@@ -100,21 +152,25 @@ class Player(GameObject):
             self.y += self.speed*dt
         if key_handler[key.DOWN] or key_handler[key.S] and self.y > 25:
             self.y -= self.speed*dt
-        self.sprite.x = self.x
-        self.sprite.y = self.y
 
         # reduce duration of invincibility
         if self.invincibility > 0:
             self.invincibility -= 1
-            self.sprite.opacity = 127*(math.sin(self.invincibility) + 1)
+
+
+    def sync(self, alpha, state = None):
+        # state is (x, y, prev_x, prev_y, invincibility) if not the player's own
+        super().sync(alpha, state)
+        invincibility = self.invincibility if state is None else state[4]
+        if invincibility > 0:
+            self.sprite.opacity = 127*(math.sin(invincibility) + 1)
         else:
             self.sprite.opacity = 255
 
 
-    def fire(self, dt, key_handler, tick):
-        bullets = []
+    def fire(self, dt, key_handler, tick, bullets):
         if self.lives < 0:
-            return bullets
+            return 0
 
         a = 0
         if key_handler[key.Z] and tick%8 == 0:
@@ -122,147 +178,88 @@ class Player(GameObject):
                 a = 5
             else:
                 a = 15
-            for i in range(-1,2):
-                bullets.append(Bullet(self.x+10*i, self.y, pyglet.sprite.Sprite(resources.player_laser_image, batch = self.sprite.batch), 600, i*a, 0.2, 15))
+            i = np.arange(-1, 2)
+            return bullets.emit(self.x + 10*i, self.y, 600, i*a, 0.2, 15, PLAYER_LASER)
 
-        return bullets
+        return 0
 
 
 class Enemy(GameObject):
-    def __init__(self, x, y, sprite, radius):
-        super().__init__(x, y, sprite)
-        self.start_health = 1000
-        self.health = self.start_health
-        self.hitbox_radius = radius
-        self.vely = -1
-        self.velx = 0
+    """ One enemy as an object, its state is a row of an Enemies store, which moves and fires every enemy at once """
+    x = Column()
+    y = Column()
+    prev_x = Column()
+    prev_y = Column()
+    velx = Column()
+    vely = Column()
+    health = Column()
+    start_health = Column()
+    hitbox_radius = Column()
+    phase_health = Column()
+    active = Column()
 
-        self.fire_rate = 1/3
-        self.time_elapsed_since_fire = 0
-        self.firing_patterns = []
-        self.angle_offset = 0
-
-
-    def update(self, dt):
-        self.velx = 10*math.sin(self.sprite.y/10)
-        self.x += self.velx*dt
-        self.y += self.vely*dt
-        self.sprite.x = self.x
-        self.sprite.y = self.y
+    def __init__(self, x, y, sprite, radius, store = None, boss = None, health = 1000):
+        store = Enemies() if store is None else store
+        # the patterns and the hp at which each phase starts, compiled from patterns.py
+        handle = store.spawn_enemies(x, y, boss or BOSSES['sky_fight'], health, radius)[0]
+        self.bind(store, handle, sprite)
 
-        hp = self.health
-        # enemy wrecks havoc when hp is low
-        if hp < 1000 and hp > 750:
-            self.firing_patterns = [BulletPatterns.enemy_pattern1]
-        if hp <= 750 and hp > 350:
-            self.firing_patterns = [BulletPatterns.enemy_pattern1, BulletPatterns.enemy_pattern2]
-        if hp <= 350:
-            self.firing_patterns = [BulletPatterns.enemy_pattern1, BulletPatterns.enemy_pattern2, BulletPatterns.enemy_pattern3]
 
+    @classmethod
+    def view(cls, store, handle, sprite):
+        """ Returns the object of an enemy already in the store """
+        enemy = cls.__new__(cls)
+        enemy.bind(store, handle, sprite)
+        return enemy
 
-    def fire(self, dt, player, tick):
-        bullets = []
-        if self.health <= 0 or player.lives < 0:
-            return bullets
 
-        else:
-            for pattern in self.firing_patterns:
-                bullets.extend(pattern(self, player, dt, tick))
+    def bind(self, store, handle, sprite):
+        self.store = store
+        self.handle = handle
+        self.row = store.row(handle)
+        store.view[self.row] = self
+        self.set_sprite(sprite)
 
-        return bullets
 
+    @property
+    def boss(self):
+        return self.store.bosses[self.store.boss_id[self.row]]
 
-############################################################################################################################################
 
+    @boss.setter
+    def boss(self, boss):
+        self.store.boss_id[self.row] = self.store.register(boss)
+        self.phase_health = UNPHASED
 
-class Bullet(GameObject):
-    def __init__(self, x, y, sprite, vel, rotation, scale, radius):
-        rotation = 0 if rotation == None else math.radians(rotation)
 
-        super().__init__(x, y, sprite)
-        self.x = x
-        self.y = y
-        self.sprite.x = self.x
-        self.sprite.y = self.y
-        self.sprite.scale = scale
-        self.rotation = rotation
-        self.hitbox_radius = radius
-        self.sprite.rotation = math.degrees(rotation)
-        self.vel = vel
-        self.velx = vel*math.cos(math.pi/2 - rotation)
-        self.vely = vel*math.sin(math.pi/2 - rotation)
+    @property
+    def firing_patterns(self):
+        phase = self.store.phase[self.row]
+        return self.boss.phases[phase][1] if phase >= 0 else []
 
 
     def update(self, dt):
-        self.x += self.velx*dt
-        self.y += self.vely*dt
-        self.sprite.x = self.x
-        self.sprite.y = self.y
-
-
-    def out_of_bounds(self, bounds = (1024, 768)):
-        return self.x < 0 or self.x > bounds[0] or self.y < 0 or self.y > bounds[1]
-
-
+        self.store.update(dt, np.array([self.row]))
 
-class BulletPatterns:
-    def enemy_pattern1(enemy, player, dt, tick):
-        bullets = []
-        angle = UtilityFunctions.firing_angle(enemy.x, enemy.y, player.x, player.y)
-        if tick%15 == 0:
-            for i in range(-3, 4):
-                bullets.append(Bullet(enemy.x, enemy.y, pyglet.sprite.Sprite(resources.circle_bullet, batch = enemy.sprite.batch), -250, i*30 + angle - tick/1.5, 1, 6))
-                bullets.append(Bullet(enemy.x, enemy.y, pyglet.sprite.Sprite(resources.circle_bullet, batch = enemy.sprite.batch), 250, i*30 + angle - tick/1.5, 1, 6))
-        return bullets
 
-
-    def enemy_pattern2(enemy, player, dt, tick):
-        bullets = []
-        angle = UtilityFunctions.firing_angle(enemy.x, enemy.y, player.x, player.y)
-        if tick%20 == 0:
-            for i in range(-6, 7):
-                bullets.append(Bullet(enemy.x, enemy.y, pyglet.sprite.Sprite(resources.circle_bullet_white, batch = enemy.sprite.batch), -300, i*15 + angle - tick/2, 1.2, 7))
-                bullets.append(Bullet(enemy.x, enemy.y, pyglet.sprite.Sprite(resources.circle_bullet_white, batch = enemy.sprite.batch), 300, i*15 + angle - tick/2, 1.2, 7))
-                bullets.append(Bullet(enemy.x, enemy.y, pyglet.sprite.Sprite(resources.oval_bullet, batch = enemy.sprite.batch), -325, i*15 + angle + tick/2, 1.2, 8))
-                bullets.append(Bullet(enemy.x, enemy.y, pyglet.sprite.Sprite(resources.oval_bullet, batch = enemy.sprite.batch), 325, i*15 + angle + tick/2, 1.2, 8))
-        return bullets
-
-
-    def enemy_pattern3(enemy, player, dt, tick):
-        bullets = []
-        angle = UtilityFunctions.firing_angle(enemy.x, enemy.y, player.x, player.y)
-        if tick%10 == 0:
-            for i in range(-3, 4):
-                if i!=0:
-                    bullets.append(Bullet(enemy.x - 200, enemy.y, pyglet.sprite.Sprite(resources.oval_bullet, batch = enemy.sprite.batch), -500, i*30 + angle, 1.5, 10))
-                    bullets.append(Bullet(enemy.x - 200, enemy.y, pyglet.sprite.Sprite(resources.oval_bullet, batch = enemy.sprite.batch), 500, i*30 + angle, 1.5, 10))
-                    bullets.append(Bullet(enemy.x + 200, enemy.y, pyglet.sprite.Sprite(resources.oval_bullet, batch = enemy.sprite.batch), -500, i*30 + angle, 1.5, 10))
-                    bullets.append(Bullet(enemy.x + 200, enemy.y, pyglet.sprite.Sprite(resources.oval_bullet, batch = enemy.sprite.batch), 500, i*30 + angle, 1.5, 10))
-        return bullets
+    def fire(self, dt, player, tick, bullets):
+        """ Fires every active pattern into bullets, returns how many bullets were fired """
+        return self.store.fire(player, tick, bullets, np.array([self.row]))
 
 
 ############################################################################################################################################
 
 
 class UtilityFunctions:
-    def distance(x, y, x2, y2):
-        """ Returns the distance between two points """
-        dx = x - x2
-        dy = y - y2
-        return math.sqrt(dx**2 + dy**2)
-
-    def firing_angle(x, y, x2, y2):
-        """ Returns the angle between two points """
-        return math.degrees(math.atan((x2 - x)/(y2 - y)))
-
-    def create_buttons(x, y, text_size_tuples, y_step=-80):
+    def create_buttons(x, y, text_size_tuples, y_step=-80, batch=None):
         """ Buttons in a column """
         buttons = []
         for i in range(len(text_size_tuples)):
-            buttons.append(Button(x, y + y_step*i, text_size_tuples[i]))
+            buttons.append(Button(x, y + y_step*i, text_size_tuples[i], batch))
         return buttons
 
-    def create_title_label(text, x = 512, y = 384, size = 24):
+    def create_title_label(text, x = 512, y = 384, size = 24, batch = None):
+        import layers
         return pyglet.text.Label(
             text=text,
             x=x, y=y,
@@ -270,10 +267,13 @@ class UtilityFunctions:
             anchor_y='center',
             font_name='ethnocentric rg',
             font_size=size,
+            batch=batch,
+            group=layers.LABELS,
         )
 
 
-    def create_label(text, x = 512, y = 384, size = 18, anchor_x = 'center', anchor_y = 'center'):
+    def create_label(text, x = 512, y = 384, size = 18, anchor_x = 'center', anchor_y = 'center', batch = None):
+        import layers
         return pyglet.text.Label(
             text=text,
             x=x, y=y,
@@ -281,15 +281,17 @@ class UtilityFunctions:
             anchor_y=anchor_y,
             font_name='ethnocentric rg',
             font_size=size,
+            batch=batch,
+            group=layers.LABELS,
         )
 
 
-    def create_labels(texts, x, y, y_step=50, size = 14, anchor_x = 'center', anchor_y = 'center'):
+    def create_labels(texts, x, y, y_step=50, size = 14, anchor_x = 'center', anchor_y = 'center', batch = None):
         """ Labels in a column """
         labels = []
         y_i = y
         for i in range(len(texts)):
-            label = UtilityFunctions.create_label(texts[i], x, y_i, size, anchor_x, anchor_y)
+            label = UtilityFunctions.create_label(texts[i], x, y_i, size, anchor_x, anchor_y, batch)
             labels.append(label)
             y_i -= y_step
         return labels
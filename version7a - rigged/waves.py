@@ -0,0 +1,34 @@
+import numpy as np
+
+from patterns import BOSSES
+
+
+# enemies sent in during a match, each group arrives on its tick in a line between two x positions
+#
+#   tick        when the group arrives
+#   count       how many enemies
+#   x           the ends of the line, y where it comes in
+#   vely        px/s, the group drifts down the field and leaves it at the bottom
+#   boss        the patterns each of them fires, by name in patterns.BOSSES
+#   health, radius
+WAVES = {
+    'swarm': [
+        {'tick': 240, 'count': 12, 'x': [60, 708], 'y': 740, 'vely': -40, 'boss': 'drone', 'health': 20, 'radius': 20},
+        {'tick': 720, 'count': 24, 'x': [40, 728], 'y': 760, 'vely': -30, 'boss': 'drone', 'health': 20, 'radius': 20},
+        {'tick': 1200, 'count': 48, 'x': [30, 738], 'y': 760, 'vely': -25, 'boss': 'drone', 'health': 10, 'radius': 16},
+    ],
+}
+
+
+class WaveScript:
+    """ Sends in the groups of a wave definition on their ticks, it keeps no state so a match put back to an earlier tick plays it again """
+    def __init__(self, groups):
+        self.groups = {}
+        for group in groups:
+            self.groups.setdefault(group['tick'], []).append(group)
+
+
+    def update(self, sim):
+        for group in self.groups.get(sim.tick_counter, []):
+            x = np.linspace(group['x'][0], group['x'][1], group['count'])
+            sim.spawn_enemies(x, group['y'], BOSSES[group['boss']], group['health'], group['radius'], group['vely'])